@@ -0,0 +1,78 @@
+#----------Keithley DMM6500 - Binary Capture File Reader and CSV Export----------#
+#
+#
+#
+#
+#   - Author: Stuart Thomas
+#   - Date: 17/10/2026
+#   - Version: 1.0
+#   - Description: - Reads the binary .dmmcap capture files written by the digitized measurement scripts, and converts them to the
+#                    original .csv layout (sample rate row, sample count row, header row, one sample per row).
+#                  - File layout:
+#                       - 8 byte magic                  b"DMMCAP01"
+#                       - uint32 (little-endian)        length of metadata header in bytes
+#                       - JSON metadata header          sample rate, range, aperture, instrument IDN, trigger time etc... (space padded)
+#                       - float64 (little-endian)       samples - start on a 64 byte boundary
+#                  - read_capture() memory-maps the samples, so any slice of a large capture can be read without loading the whole file.
+#                  - Usage:  py DMM6500_Capture-Export.py <capture files...>         (prompts for a file if none given)
+#                  - Each .csv is written next to its capture file.
+
+import json
+import struct
+import sys
+import numpy as np
+
+# Binary capture file layout (must match the digitized measurement scripts)
+CAPTURE_MAGIC = b"DMMCAP01"
+
+
+def read_capture(capture_filename):
+    """
+    Reads a .dmmcap capture file and returns (metadata, samples).
+    'samples' is a read-only float64 memory map - index or slice it to read only the samples required.
+    """
+    with open(capture_filename, "rb") as capture_file:
+        magic = capture_file.read(len(CAPTURE_MAGIC))
+        if magic != CAPTURE_MAGIC:
+            raise ValueError(f"{capture_filename} is not a DMM6500 capture file")
+        header_length = struct.unpack("<I", capture_file.read(4))[0]
+        metadata = json.loads(capture_file.read(header_length).decode("utf-8"))
+
+    data_offset = len(CAPTURE_MAGIC) + 4 + header_length
+    samples = np.memmap(capture_filename, dtype=metadata["dtype"], mode="r", offset=data_offset,
+                        shape=(metadata["num_samples"],))
+    return metadata, samples
+
+
+def export_csv(capture_filename, csv_filename=None):
+    """
+    Converts a .dmmcap capture file to the original one-sample-per-row .csv layout.
+    Returns the name of the .csv file written.
+    """
+    metadata, samples = read_capture(capture_filename)
+    if csv_filename is None:
+        csv_filename = capture_filename.rsplit(".", 1)[0] + ".csv"
+
+    header = "\n".join([f"Sample Rate: {metadata['sample_rate']}",
+                        f"No. Samples: {metadata['num_samples']}",
+                        f"{metadata['quantity']} ({metadata['unit']})"])
+    np.savetxt(csv_filename, samples, fmt="%.17g", header=header, comments="")
+    return csv_filename
+
+
+def main():
+    capture_filenames = sys.argv[1:]
+    if not capture_filenames:
+        capture_filenames = [input("Please enter the capture file to export (.dmmcap): ").strip().strip('"')]
+
+    for capture_filename in capture_filenames:
+        metadata, samples = read_capture(capture_filename)
+        print(f"{capture_filename}:")
+        for key, value in metadata.items():
+            print(f"    {key}: {value}")
+        csv_filename = export_csv(capture_filename)
+        print(f"Exported to '{csv_filename}'\n")
+
+
+if __name__ == "__main__":
+    main()
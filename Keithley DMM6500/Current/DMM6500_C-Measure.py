@@ -1,7 +1,145 @@
 import csv
+import os
+import queue
+import threading
 import time
 import pyvisa
 
+# Log file settings - rows are flushed to disk every 'log_flush_interval' seconds or 'log_flush_rows' rows,
+# and a new numbered file is started every 'log_max_bytes' bytes or 'log_max_age' seconds (None = no limit)
+log_flush_interval = 1.0
+log_flush_rows = 100
+log_max_bytes = 100e6
+log_max_age = 24 * 60 * 60
+
+class DeadlineScheduler:
+    # Paces a fixed-rate loop on absolute deadlines (start + n * period) - no drift, overruns skip missed periods, jitter tracked
+    def __init__(self, period, spin_threshold=0.002):
+        self.period = period
+        self.spin_threshold = spin_threshold
+        self.start_time = None
+        self.deadline = None
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter_mean = 0.0
+        self.jitter_m2 = 0.0
+        self.jitter_max = 0.0
+
+    def wait(self):
+        # Blocks until the next deadline and returns it (first call starts the schedule) - sleeps, then spins the last 'spin_threshold'
+        now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = self.deadline = now
+        else:
+            self.deadline += self.period
+            if now > self.deadline:
+                # Overrun - previous iteration took longer than one period, skip any whole periods missed
+                self.overruns += 1
+                missed = int((now - self.deadline) // self.period)
+                self.skipped += missed
+                self.deadline += missed * self.period
+            else:
+                remaining = self.deadline - now
+                if remaining > self.spin_threshold:
+                    time.sleep(remaining - self.spin_threshold)
+                while time.perf_counter() < self.deadline:
+                    pass
+
+        # Running jitter statistics (Welford)
+        jitter = time.perf_counter() - self.deadline
+        self.ticks += 1
+        delta = jitter - self.jitter_mean
+        self.jitter_mean += delta / self.ticks
+        self.jitter_m2 += delta * (jitter - self.jitter_mean)
+        self.jitter_max = max(self.jitter_max, jitter)
+        return self.deadline
+
+    def summary(self):
+        # One line report of target vs. achieved rate, overruns and jitter
+        if self.ticks < 2:
+            return "Scheduler: not enough samples for rate statistics"
+        achieved_rate = (self.ticks - 1) / (self.deadline - self.start_time)
+        jitter_std = (self.jitter_m2 / (self.ticks - 1)) ** 0.5
+        return (f"Scheduler: target {1 / self.period:.3f} Hz, achieved {achieved_rate:.3f} Hz over {self.ticks} samples | "
+                f"overruns: {self.overruns} ({self.skipped} samples skipped) | "
+                f"jitter mean {self.jitter_mean * 1e3:.3f} ms, std {jitter_std * 1e3:.3f} ms, max {self.jitter_max * 1e3:.3f} ms")
+
+class RotatingCsvLogger:
+    # .csv logger - writerow() only queues the row, a background thread writes batches every 'flush_interval' s or 'flush_rows' rows
+    # Output split into numbered files (<name>_001.csv...) every 'max_bytes' bytes or 'max_age' seconds (None = no limit)
+    def __init__(self, filename, header, flush_interval=1.0, flush_rows=100, max_bytes=100e6, max_age=None):
+        self.base_name, self.extension = os.path.splitext(filename)
+        self.header = header
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.file_index = 0
+        self.file = None
+        self.filenames = []
+        self.error = None
+        self.rows = queue.Queue()
+        self.thread = threading.Thread(target=self.write_rows, daemon=True)
+        self.thread.start()
+
+    def writerow(self, row):
+        if self.error is not None:
+            raise self.error
+        self.rows.put(row)
+
+    def close(self):
+        # Writes any queued rows, closes the current file and stops the writer thread
+        self.rows.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def open_next_file(self):
+        if self.file is not None:
+            self.file.close()
+        self.file_index += 1
+        filename = f"{self.base_name}_{self.file_index:03d}{self.extension}"
+        self.file = open(filename, "w", newline='')
+        self.csv_writer = csv.writer(self.file)
+        self.csv_writer.writerow(self.header)
+        self.file_opened = time.monotonic()
+        self.filenames.append(filename)
+
+    def write_batch(self, batch):
+        if self.file is None or self.file.tell() >= self.max_bytes or \
+                (self.max_age is not None and time.monotonic() - self.file_opened >= self.max_age):
+            self.open_next_file()
+        self.csv_writer.writerows(batch)
+        self.file.flush()
+
+    def write_rows(self):
+        # Writer thread
+        batch = []
+        last_flush = time.monotonic()
+        running = True
+        try:
+            while running:
+                try:
+                    row = self.rows.get(timeout=max(0, self.flush_interval - (time.monotonic() - last_flush)))
+                    if row is None:
+                        running = False
+                    else:
+                        batch.append(row)
+                except queue.Empty:
+                    pass
+
+                if batch and (not running or len(batch) >= self.flush_rows or time.monotonic() - last_flush >= self.flush_interval):
+                    self.write_batch(batch)
+                    batch = []
+                if not batch:
+                    last_flush = time.monotonic()
+        except Exception as error:
+            self.error = error
+        finally:
+            if self.file is not None:
+                self.file.close()
+
 def main():
     # Connect to the Keithley DMM6500
     rm = pyvisa.ResourceManager()
@@ -12,13 +150,15 @@ def main():
     dmm.write(":SENS:FUNC:CURR:DC")
 
     # Create CSV file for logging
-    csv_file = open("C_DMM6500.csv", "w", newline='')
-    csv_writer = csv.writer(csv_file)
-    csv_writer.writerow(["Timestamp", "Current (A)"])
+    csv_logger = RotatingCsvLogger("C_DMM6500.csv", ["Timestamp", "Current (A)"], log_flush_interval, log_flush_rows, log_max_bytes, log_max_age)
+
+    # Readings paced at 10 per second on absolute deadlines
+    scheduler = DeadlineScheduler(0.1)
 
     try:
         # Continuously collect current readings
         while True:
+            scheduler.wait()
             start_time = time.time()
 
             # Query current reading from DMM
@@ -26,18 +166,15 @@ def main():
 
             # Log timestamp and current to CSV file with milliseconds
             timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))
-            csv_writer.writerow([timestamp, current])
-            csv_file.flush()  # Flush buffer to ensure data is written immediately
-
-            # Wait for next reading
-            elapsed_time = time.time() - start_time
-            time.sleep(max(0, 0.1 - elapsed_time))  # Ensure 10 readings per second
+            csv_logger.writerow([timestamp, current])
 
     except KeyboardInterrupt:
         print("Script terminated by user.")
     finally:
+        print(scheduler.summary())
         # Close CSV file and instrument connection
-        csv_file.close()
+        csv_logger.close()
+        print(f"Readings logged to {', '.join(csv_logger.filenames)}")
         dmm.close()
         rm.close()
 
@@ -5,10 +5,12 @@
 #
 #   - Author: Stuart Thomas
 #   - Date: 23/06/2025
-#   - Version: 2.0
+#   - Version: 2.1
 #    - Changelog: 1.1 -> 2.0
 #          - Digitisation set to max, Fs set to 1kHz in code
 #          - CSV file incrementing
+#    - Changelog: 2.0 -> 2.1
+#          - Test numbers allocated with allocate_test_number() - unique across concurrent capture processes in the same directory
 #   - Description: - Program takes digitized current readings on a Keithley DMM6500, using an external trigger to begin the readings.
 #		   - Users can specify the sample rate and number of samples to read.
 #		   - Output data is stored as a .csv file with each entry being a double precision float.
@@ -107,17 +109,8 @@ def main():
     c_data = dmm.query(f":TRAC:DATA? 1, {num_samples}, 'cDataBuffer', READ")
     c_data_floats = parse_data(c_data)					# Convert multi-row string into single row float for each element
 
-    # File to store the current test number
-    test_number_file = "test_number.txt"
-
-    # Check if the file exists, if not create it with test number 1
-    if not os.path.exists(test_number_file):
-        with open(test_number_file, "w") as f:
-            f.write("1")
-
-    # Read the current test number
-    with open(test_number_file, "r") as f:
-        test_number = int(f.read().strip())
+    # Allocate a unique test number
+    test_number = allocate_test_number("test_number.txt")
 
     # Create a unique filename based on the test number
     csv_filename = f"C_DMM6500_c_{test_number}.csv"
@@ -131,11 +124,6 @@ def main():
         for data in c_data_floats:
             csv_writer.writerow([data])
 
-    # Update test number for next run
-    with open(test_number_file, "w") as f:
-        f.write(str(test_number + 1))
-
- 
 
     # Close CSV file and instrument connection
     #csv_file.close()
@@ -144,6 +132,48 @@ def main():
 
     print(f"Measurement complete - see 'C_DMM6500_c_{test_number}.csv' (in relative folder) for output.")
 
+def allocate_test_number(file_path='test_number.txt'):
+    """
+    Allocates the next unique test number - safe for several capture processes/stations sharing the same directory.
+    Each number is claimed by atomically creating a marker file in '<file_path>.claims' (exclusive create only
+    succeeds for one process), so no lock is taken and concurrent writers never wait on each other.
+    'file_path' only holds a hint of the next free number, so existing test number files carry on from their current value.
+    """
+    claims_dir = file_path + ".claims"
+    os.makedirs(claims_dir, exist_ok=True)
+
+    # Start from hint of next free number (fall back to highest claimed number if hint is missing)
+    try:
+        with open(file_path, 'r') as file:
+            test_number = int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        claimed = [int(name) for name in os.listdir(claims_dir) if name.isdigit()]
+        test_number = max(claimed, default=0) + 1
+
+    # Claim first free number at or above the hint
+    while True:
+        try:
+            os.close(os.open(os.path.join(claims_dir, str(test_number)), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            test_number += 1
+
+    # Advance hint - never moved back by a slower process, and written to a temporary file then renamed so it is never read half written.
+    # (Two processes can still race between the check and the rename - a stale hint only costs extra claim attempts, as numbers are
+    # always claimed in order from the hint, so they stay unique and increasing)
+    try:
+        with open(file_path, 'r') as file:
+            current_hint = int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        current_hint = 0
+    if test_number + 1 > current_hint:
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            file.write(str(test_number + 1))
+        os.replace(temp_path, file_path)
+
+    return test_number
+
 def parse_data(c_data):
     """
     Parses the current data array where each number is represented as a list of characters
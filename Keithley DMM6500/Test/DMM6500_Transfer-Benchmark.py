@@ -0,0 +1,164 @@
+#----------Keithley DMM6500 - Buffer Transfer Benchmark - ASCII vs. Binary (REAL)----------#
+#
+#
+#
+#
+#   - Author: Stuart Thomas
+#   - Date: 17/10/2026
+#   - Version: 1.1
+#    - Changelog: 1.0 -> 1.1
+#          - Added vectorized (numpy) ASCII parser micro-benchmark against the original per-element parse_data() loop
+#   - Description: - Compares the ':TRAC:DATA?' transfer paths used by the digitized measurement scripts:
+#                       - ASCII     -   comma separated reply, converted with the original per-element parse_data() loop
+#                       - ASCII     -   comma separated reply, converted with the vectorized parse_data()
+#                       - REAL      -   IEEE-754 doubles in a definite-length block, read straight into a float64 array
+#                  - Replies are generated on the host in the same format the DMM6500 sends them, so no instrument is required.
+#                  - Bytes on the wire and decode time are reported at 10k, 100k and 1M samples.
+#                  - Bus transfer time scales with the number of bytes sent, so the byte ratio is the expected link time saving.
+
+import time
+import warnings
+import numpy as np
+from pyvisa.util import from_ieee_block, to_ieee_block
+
+# Sample counts to benchmark
+sample_counts = [10000, 100000, 1000000]
+
+# Number of times each decode is repeated (best time is reported)
+repeats = 3
+
+
+def parse_data_loop(c_data):
+    """
+    Parses the current data array where each number is represented as a list of characters
+    and returns a list of floating-point numbers. Handles negative numbers and skips malformed entries.
+    (Copy of original per-element ASCII parser from the digitized measurement scripts)
+    """
+    c_data_floats = []
+
+    # First, join the list of characters into a string, then split by commas to separate each number
+    current_string = ''.join(c_data)  # Join all characters into a single string
+
+    # Split the string by commas to separate each voltage reading
+    current_entries = current_string.split(',')
+
+    for current_str in current_entries:
+        # Skip empty entries or malformed entries
+        if not current_str or current_str in ['-', '.', 'E', '-.', '.E', 'E-']:
+            print(f"Skipping invalid string: {current_str}")
+            continue
+
+        # Try to convert the valid voltage string to a float
+        try:
+            current_float = float(current_str)
+            c_data_floats.append(current_float)
+        except ValueError:
+            print(f"Error converting current string to float: {current_str}")
+
+    return c_data_floats
+
+
+def parse_data(c_data):
+    """
+    Converts the comma separated ASCII reply from ':TRAC:DATA?' into a float64 array in a single vectorized pass.
+    Malformed entries are dropped from the returned readings rather than printed - 'bad_mask' flags them,
+    with one entry per comma separated token in the reply.
+    Returns (c_data_floats, bad_mask).
+    (Copy of vectorized ASCII parser from the digitized measurement scripts)
+    """
+    current_string = c_data.strip()
+    num_tokens = current_string.count(',') + 1 if current_string else 0
+
+    # Fast path - whole reply converted in C (numpy warns, rather than raising, if it stops early on a malformed entry)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            c_data_floats = np.fromstring(current_string, dtype=np.float64, sep=',')
+            if c_data_floats.size == num_tokens:
+                return c_data_floats, np.zeros(num_tokens, dtype=bool)
+        except (DeprecationWarning, ValueError):
+            pass
+
+    # Slow path - only taken when the reply contains malformed entries
+    current_entries = current_string.split(',') if current_string else []
+    c_data_floats = np.empty(num_tokens)
+    bad_mask = np.ones(num_tokens, dtype=bool)
+    for index, current_str in enumerate(current_entries):
+        try:
+            c_data_floats[index] = float(current_str)
+            bad_mask[index] = False
+        except ValueError:
+            pass
+
+    return c_data_floats[~bad_mask], bad_mask
+
+
+def make_replies(num_samples):
+    """
+    Builds an ASCII reply and a binary (REAL, little-endian) reply containing the same digitized readings.
+    """
+    rng = np.random.default_rng(0)
+    readings = 1e-3 * np.sin(np.arange(num_samples) / 50.0) + 1e-6 * rng.standard_normal(num_samples)
+
+    ascii_reply = ",".join(f"{value:.9E}" for value in readings) + "\n"
+    binary_reply = bytes(to_ieee_block(readings, datatype='d', is_big_endian=False)) + b"\n"
+
+    return readings, ascii_reply, binary_reply
+
+
+def best_time(func, *args):
+    """
+    Returns the result and the fastest of 'repeats' runs of func(*args) in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start_time)
+    return result, best
+
+
+def decode_binary(binary_reply):
+    return from_ieee_block(binary_reply, datatype='d', is_big_endian=False, container=np.array)
+
+
+def main():
+    print("-------------------------------------------------------------------------------------")
+    print("--------Keithley DMM6500 - Buffer Transfer Benchmark - ASCII vs. Binary (REAL)-------")
+    print("-------------------------------------------------------------------------------------")
+    print("\n")
+    results = []
+    for num_samples in sample_counts:
+        readings, ascii_reply, binary_reply = make_replies(num_samples)
+
+        loop_values, loop_time = best_time(parse_data_loop, ascii_reply)
+        (ascii_values, bad_mask), ascii_time = best_time(parse_data, ascii_reply)
+        binary_values, binary_time = best_time(decode_binary, binary_reply)
+
+        # Sanity check - all paths must return the same readings
+        assert np.array_equal(ascii_values, loop_values) and not bad_mask.any()
+        assert np.allclose(ascii_values, readings, rtol=1e-8)
+        assert np.array_equal(binary_values, readings)
+
+        results.append((num_samples, len(ascii_reply.encode("ascii")), len(binary_reply), loop_time, ascii_time, binary_time))
+
+    # ASCII parser - original loop vs. vectorized
+    print("ASCII parser - per-element loop vs. vectorized:")
+    print(f"{'Samples':>10} | {'Loop parse (s)':>14} | {'Vectorized parse (s)':>20} | {'Speedup':>8}")
+    print("-" * 63)
+    for num_samples, _, _, loop_time, ascii_time, _ in results:
+        print(f"{num_samples:>10} | {loop_time:>14.4f} | {ascii_time:>20.4f} | {loop_time / ascii_time:>7.1f}x")
+    print("\n")
+
+    # Transfer format - ASCII vs. REAL
+    print("Transfer format - ASCII (vectorized parse) vs. REAL:")
+    print(f"{'Samples':>10} | {'ASCII bytes':>12} | {'REAL bytes':>12} | {'Byte ratio':>10} | {'ASCII decode (s)':>16} | {'REAL decode (s)':>15} | {'Speedup':>8}")
+    print("-" * 104)
+    for num_samples, ascii_bytes, binary_bytes, _, ascii_time, binary_time in results:
+        print(f"{num_samples:>10} | {ascii_bytes:>12} | {binary_bytes:>12} | {ascii_bytes / binary_bytes:>10.2f} | "
+              f"{ascii_time:>16.4f} | {binary_time:>15.6f} | {ascii_time / binary_time:>7.0f}x")
+    print("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,43 @@
 #
 #   - Author: Stuart Thomas
 #   - Date: 09/07/2025
-#   - Version: 2.0
+#   - Version: 2.9
 #    - Changelog: 1.1 -> 2.0
 #          - Digitisation set to max, Fs set to 1kHz in code
 #          - CSV file incrementing
+#    - Changelog: 2.0 -> 2.1
+#          - Streaming capture - completed readings are pulled from the buffer in chunks while the DMM is still digitizing
+#    - Changelog: 2.1 -> 2.2
+#          - Optional binary (REAL - IEEE-754 double precision) buffer transfer, read directly into a numpy float64 array
+#    - Changelog: 2.2 -> 2.3
+#          - ':TRAC:ACTUAL?' busy-wait replaced with an adaptive completion waiter (one query per poll, sleeps until predicted completion)
+#    - Changelog: 2.3 -> 2.4
+#          - parse_data() vectorized with numpy - malformed entries returned as a mask rather than printed one per line
+#    - Changelog: 2.4 -> 2.5
+#          - Warm re-arm - DMM configured once, each further capture only clears the buffer and re-sends INIT (re-arm latency reported)
+#    - Changelog: 2.5 -> 2.6
+#          - Multi-shot capture - trigger model loops WAIT EXT -> MDIG for 'num_bursts' triggers, bursts downloaded by a background thread
+#    - Changelog: 2.6 -> 2.7
+#          - Binary capture file output (.dmmcap) - float64 samples plus structured metadata, see 'Capture Export' for reader/CSV exporter
+#    - Changelog: 2.7 -> 2.8
+#          - Background file writer - captures queued and written in parallel with the next acquisition (bounded queue applies backpressure)
+#    - Changelog: 2.8 -> 2.9
+#          - Test numbers allocated with allocate_test_number() - unique across concurrent capture processes in the same directory
 #   - Description: - Program takes digitized voltage readings on a Keithley DMM6500, using an external trigger to begin the readings.
 #		   - Users can specify the sample rate and number of samples to read.
-#		   - Output data is stored as a .csv file with each entry being a double precision float.
+#		   - Output data is stored as a binary .dmmcap capture file (double precision samples and capture metadata), or as a .csv file.
 
 
 import csv
+import json
 import os
+import queue
+import struct
+import threading
 import time
+import warnings
+from datetime import datetime
+import numpy as np
 import pyvisa
 from tqdm import tqdm
 
@@ -39,6 +64,7 @@ print("    - Pre-requisites:")
 print("        - pyvisa Python library")
 print("        - NI-VISA drivers")
 print("        - tqdm Python library")
+print("        - numpy Python library")
 print("\n\n")
 
 # Calibration prompt
@@ -60,14 +86,106 @@ sample_rate = 1000
 
 # Num samples set to 100000 by default (max digitisation value)
 num_samples = 10000
-buffer_size = num_samples + 5                                           # Make buffer size slightly larger than number of samples to be collected
+
+# Number of triggered bursts of 'num_samples' collected per capture - trigger model loops back to wait for the next trigger (1 = single shot)
+num_bursts = 1
+
+buffer_size = num_samples * num_bursts + 5                              # Make buffer size slightly larger than number of samples to be collected
 #buffer_size = num_samples
 
+# Streaming capture - pull readings from the buffer in chunks during digitisation (set to False to read whole buffer on completion)
+stream_capture = True
+chunk_size = 2000                                                       # Number of readings transferred per buffer read when streaming
+
+# Binary transfer - buffer readings sent as IEEE-754 doubles in a definite-length block (set to False for ASCII transfer)
+binary_transfer = True
+
+# Completion waiter - buffer fill rate is predicted from 'sample_rate', polls back off while waiting for the trigger
+min_poll_interval = 0.005                                               # Shortest wait between ':TRAC:ACTUAL?' polls (s)
+max_poll_interval = 0.5                                                 # Longest wait between polls - also sets progress bar update rate (s)
+capture_timeout = 10                                                    # Time allowed past predicted completion before the capture is abandoned (s)
+
+# Warm re-arm - configure DMM once, then re-arm with a buffer clear and INIT only (set to False to reconnect and reset for every capture)
+warm_rearm = True
+capture_complete_time = None                                            # Time last capture finished transferring - used to report re-arm latency
+
+# Output file format - "dmmcap" (binary capture file) or "csv" (one row per sample)
+output_format = "dmmcap"
+capture_metadata = {}                                                   # Instrument settings recorded in each capture file - filled in by configure_dmm()
+
+# Binary capture file layout - magic, header length (uint32), JSON metadata header, float64 samples (all little-endian)
+# Samples start on a 64 byte boundary so the file can be memory-mapped for random access
+CAPTURE_MAGIC = b"DMMCAP01"
+CAPTURE_ALIGNMENT = 64
+
+# Background file writer - finished captures are queued and written to file while the next capture is acquired
+writer_queue_depth = 4                                                  # Max captures waiting to be written - acquisition waits when the queue is full
+
 def main():
     # Connect to the Keithley DMM6500
     rm = pyvisa.ResourceManager()
     dmm = rm.open_resource('USB0::0x05E6::0x6500::04536806::INSTR')     # See PyVisa main webpage for setup information
 
+    # Start background file writer
+    write_queue = queue.Queue(maxsize=writer_queue_depth)
+    writer_thread = threading.Thread(target=file_writer, args=(write_queue,), daemon=True)
+    writer_thread.start()
+
+    try:
+        configure_dmm(dmm)
+        arm_dmm(dmm)
+
+        while True:
+            if num_bursts > 1:
+                # Multi-shot - bursts are queued for writing as they are downloaded
+                capture_bursts(dmm, write_queue)
+                if warm_rearm:
+                    arm_dmm(dmm)
+            else:
+                v_data_floats, trigger_time = acquire(dmm)
+
+                # Warm re-arm - buffer already on host, so clear it and wait for the next trigger straight away
+                if warm_rearm:
+                    arm_dmm(dmm)
+
+                queue_capture(write_queue, (v_data_floats, trigger_time))
+
+            if not warm_rearm:
+                break
+    finally:
+        # Finish writing any queued captures, then close instrument connection
+        write_queue.put(None)
+        writer_thread.join()
+        dmm.close()
+        rm.close()
+
+def queue_capture(write_queue, capture):
+    """
+    Hands a finished capture (readings, trigger time) to the background file writer.
+    Blocks if 'writer_queue_depth' captures are already waiting, so acquisition cannot outrun the disk indefinitely.
+    """
+    if write_queue.full():
+        print("File writer falling behind - waiting for queued captures to be written...")
+    write_queue.put(capture)
+
+def file_writer(write_queue):
+    """
+    Background file writer thread - writes queued captures until a None entry is received.
+    """
+    while True:
+        capture = write_queue.get()
+        if capture is None:
+            break
+        try:
+            save_capture(*capture)
+        except Exception as error:
+            print(f"ERROR - capture could not be written to file: {error}")
+
+def configure_dmm(dmm):
+    """
+    Resets the DMM and sets up digitize mode, the reading buffer, transfer format and trigger model.
+    Only called once per connection when 'warm_rearm' is set.
+    """
     # Setup DMM for voltage measurements
     dmm.write("*RST")
     dmm.write(":DIG:FUNC 'VOLT'")					   # Digitize mode - voltage measurements
@@ -80,6 +198,18 @@ def main():
     dmm.write(":DIG:VOLT:APER AUTO")					# Digitize mode - auto aperture setting
     dmm.write(f":DIG:COUNT {num_samples}")				# Digitize mode - number of samples to take (to be stored in 'defbuffer1')
 
+    # Record instrument settings for capture file metadata
+    capture_metadata["instrument_idn"] = dmm.query("*IDN?").strip()
+    capture_metadata["range"] = query_setting(dmm, ":DIG:VOLT:RANG?")
+    capture_metadata["aperture"] = query_setting(dmm, ":DIG:VOLT:APER?")
+
+    # Set reading transfer format - REAL (double precision binary, little-endian) or ASCII
+    if binary_transfer:
+        dmm.write(":FORM:DATA REAL")
+        dmm.write(":FORM:BORD SWAP")
+    else:
+        dmm.write(":FORM:DATA ASCII")
+
     # Setup trigger
     dmm.write(":TRIG:EXT:IN:CLE")					# Clear previous ext trigger flags
     dmm.write(":TRIG:EXT:IN:EDGE RIS")
@@ -91,86 +221,296 @@ def main():
     dmm.write(":TRIG:BLOCK:NOTIFY 3, 1")                # Create Notify block for block 3, call it 'Notify1'
     dmm.write(":TRIG:EXT:OUT:LOG POS")                  # Set ext out trigger to positive pulse logic
     dmm.write("TRIG:EXT:OUT:STIM NOTIFY1")              #Stimulus for ext trigger is assertion of 'Notify1' Triggerflow block
+    if num_bursts > 1:
+        dmm.write(f":TRIG:BLOCK:BRAN:COUN 4, {num_bursts}, 1")      # Add 'BRANCH COUNTER' block - loop back to 'WAIT' until all bursts are taken
+
+def query_setting(dmm, command):
+    """
+    Queries an instrument setting - returned as a float if numeric, otherwise as the reply string (e.g. 'AUTO').
+    """
+    reply = dmm.query(command).strip()
+    try:
+        return float(reply)
+    except ValueError:
+        return reply
+
+def arm_dmm(dmm):
+    """
+    Clears 'vDataBuffer' and starts the trigger model so the DMM waits for the next external trigger.
+    Reports the re-arm latency (time from the previous capture reaching the host to INIT being sent).
+    """
+    dmm.write(":TRAC:CLE 'vDataBuffer'")				# Clear readings from previous capture
 
     # Initilise DMM - wait for external trigger
     dmm.write("INIT")
+    if capture_complete_time is not None:
+        print(f"Re-arm latency: {(time.perf_counter() - capture_complete_time) * 1000:.1f} ms")
     print("Waiting for external trigger activation...")
     print("\n\n")
 
-    # Wait for buffer to be full...
+def capture_bursts(dmm, write_queue):
+    """
+    Multi-shot capture - a background thread downloads each burst as soon as it is complete, while this thread
+    splits the capture per trigger and queues each burst to be written to its own numbered file.
+    """
+    burst_queue = queue.Queue()
+    download_thread = threading.Thread(target=download_bursts, args=(dmm, burst_queue), daemon=True)
+    download_thread.start()
+
+    burst_number = 0
+    while True:
+        burst = burst_queue.get()
+        if burst is None:
+            break
+        if isinstance(burst, Exception):
+            raise burst
+        burst_number += 1
+        print(f"Burst {burst_number} of {num_bursts} downloaded")
+        queue_capture(write_queue, burst)
+
+    download_thread.join()
+
+def download_bursts(dmm, burst_queue):
+    """
+    Background download thread for multi-shot captures. Waits for each burst in turn and passes its readings and
+    trigger time to 'burst_queue' - followed by None once all bursts are downloaded (or the exception if the download fails).
+    """
+    try:
+        for burst_index in range(num_bursts):
+            burst_queue.put(acquire(dmm, burst_index * num_samples))
+    except Exception as error:
+        burst_queue.put(error)
+        return
+    burst_queue.put(None)
+
+def acquire(dmm, start_count=0):
+    """
+    Waits for the armed capture to complete (streaming readings out of the buffer if 'stream_capture' is set)
+    and returns the readings as a float64 array, along with the estimated trigger time (seconds since the epoch).
+    For multi-shot captures 'start_count' is the number of readings stored by earlier bursts.
+    """
+    global capture_complete_time
+
+    # Wait for buffer to be full (or stream readings out of the buffer as they are taken)...
+    poll_stats = {"polls": 0, "wasted_s": 0.0, "trigger_time": None}
     with tqdm(total=num_samples, desc="Readings Taken: ", ncols=100) as pbar:    # Add tqdm prog bar
-        while int(dmm.query(":TRAC:ACTUAL? 'vDataBuffer'")) < num_samples:
-            voltage_sample = int(dmm.query(":TRAC:ACTUAL? 'vDataBuffer'"))
-            pbar.update(voltage_sample - pbar.n)
+        if stream_capture:
+            v_data_floats = stream_buffer(dmm, pbar, poll_stats, start_count)
+        else:
+            wait_for_buffer(dmm, start_count + num_samples, pbar, poll_stats, start_count)
 
     # Read buffer
-    v_data = dmm.query(f":TRAC:DATA? 1, {num_samples}, 'vDataBuffer', READ")
-    v_data_floats = parse_data(v_data)					# Convert multi-row string into single row float for each element
+    if not stream_capture:
+        v_data_floats = read_buffer(dmm, start_count + 1, start_count + num_samples)
 
-    # File to store the current test number
-    test_number_file = "test_number.txt"
+    capture_complete_time = time.perf_counter()
+    print(f"Buffer polls: {poll_stats['polls']}    Wasted wait time: {poll_stats['wasted_s'] * 1000:.1f} ms")
 
-    # Check if the file exists, if not create it with test number 1
-    if not os.path.exists(test_number_file):
-        with open(test_number_file, "w") as f:
-            f.write("1")
+    return v_data_floats, poll_stats["trigger_time"]
 
-    # Read the current test number
-    with open(test_number_file, "r") as f:
-        test_number = int(f.read().strip())
+def save_capture(v_data_floats, trigger_time):
+    """
+    Writes a capture to the next numbered .dmmcap (or .csv, see 'output_format') file in the relative folder.
+    """
+    # Allocate a unique test number
+    test_number = allocate_test_number("test_number.txt")
 
     # Create a unique filename based on the test number
-    csv_filename = f"V_DMM6500_v_{test_number}.csv"
-
-    # Write data to CSV file
-    with open(csv_filename, "w", newline='') as csv_file:
-        csv_writer = csv.writer(csv_file)
-        csv_writer.writerow([f"Sample Rate: {sample_rate}"])
-        csv_writer.writerow([f"No. Samples: {num_samples}"])
-        csv_writer.writerow(["Voltage (V)"])
-        for data in v_data_floats:
-            csv_writer.writerow([data])
+    if output_format == "dmmcap":
+        output_filename = f"V_DMM6500_v_{test_number}.dmmcap"
+        write_capture(output_filename, v_data_floats, trigger_time)
+    else:
+        output_filename = f"V_DMM6500_v_{test_number}.csv"
+
+        # Write data to CSV file
+        with open(output_filename, "w", newline='') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow([f"Sample Rate: {sample_rate}"])
+            csv_writer.writerow([f"No. Samples: {num_samples}"])
+            csv_writer.writerow(["Voltage (V)"])
+            for data in v_data_floats:
+                csv_writer.writerow([data])
+
+    print(f"Measurement complete - see '{output_filename}' (in relative folder) for output.")
+
+def allocate_test_number(file_path='test_number.txt'):
+    """
+    Allocates the next unique test number - safe for several capture processes/stations sharing the same directory.
+    Each number is claimed by atomically creating a marker file in '<file_path>.claims' (exclusive create only
+    succeeds for one process), so no lock is taken and concurrent writers never wait on each other.
+    'file_path' only holds a hint of the next free number, so existing test number files carry on from their current value.
+    """
+    claims_dir = file_path + ".claims"
+    os.makedirs(claims_dir, exist_ok=True)
 
-    # Update test number for next run
-    with open(test_number_file, "w") as f:
-        f.write(str(test_number + 1))
+    # Start from hint of next free number (fall back to highest claimed number if hint is missing)
+    try:
+        with open(file_path, 'r') as file:
+            test_number = int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        claimed = [int(name) for name in os.listdir(claims_dir) if name.isdigit()]
+        test_number = max(claimed, default=0) + 1
+
+    # Claim first free number at or above the hint
+    while True:
+        try:
+            os.close(os.open(os.path.join(claims_dir, str(test_number)), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            test_number += 1
+
+    # Advance hint - never moved back by a slower process, and written to a temporary file then renamed so it is never read half written.
+    # (Two processes can still race between the check and the rename - a stale hint only costs extra claim attempts, as numbers are
+    # always claimed in order from the hint, so they stay unique and increasing)
+    try:
+        with open(file_path, 'r') as file:
+            current_hint = int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        current_hint = 0
+    if test_number + 1 > current_hint:
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            file.write(str(test_number + 1))
+        os.replace(temp_path, file_path)
+
+    return test_number
+
+def write_capture(capture_filename, v_data_floats, trigger_time):
+    """
+    Writes a binary capture file - structured metadata header followed by the raw float64 samples.
+    Use 'Capture Export/DMM6500_Capture-Export.py' to read the file back or convert it to the original .csv layout.
+    """
+    metadata = dict(capture_metadata)
+    metadata.update({
+        "quantity": "Voltage",
+        "unit": "V",
+        "sample_rate": sample_rate,
+        "num_samples": len(v_data_floats),
+        "trigger_time": datetime.fromtimestamp(trigger_time).isoformat(timespec="microseconds") if trigger_time else None,
+        "dtype": "<f8",
+    })
+
+    # Pad header so that the samples start on an aligned offset
+    header = json.dumps(metadata).encode("utf-8")
+    header_end = len(CAPTURE_MAGIC) + 4 + len(header)
+    header += b" " * (-header_end % CAPTURE_ALIGNMENT)
+
+    with open(capture_filename, "wb") as capture_file:
+        capture_file.write(CAPTURE_MAGIC)
+        capture_file.write(struct.pack("<I", len(header)))
+        capture_file.write(header)
+        np.asarray(v_data_floats, dtype="<f8").tofile(capture_file)
+
+def stream_buffer(dmm, pbar, poll_stats, start_count=0):
+    """
+    Transfers completed readings out of 'vDataBuffer' in chunks of 'chunk_size' while the trigger model is still
+    digitizing, so that almost all of the data is already on the host when the final sample is taken.
+    Readings 'start_count' + 1 to 'start_count' + 'num_samples' are returned as a float64 array in buffer order.
+    """
+    v_data_chunks = []
+    num_read = 0                                                        # Number of readings already transferred to host
 
- 
+    while num_read < num_samples:
+        # Wait for a full chunk to be available (or the final, partial chunk to be complete)
+        num_stored = wait_for_buffer(dmm, start_count + min(num_read + chunk_size, num_samples), pbar, poll_stats, start_count)
+        end_index = min(num_stored - start_count, num_samples)
+        v_data_chunks.append(read_buffer(dmm, start_count + num_read + 1, start_count + end_index))
+        num_read = end_index
 
-    # Close CSV file and instrument connection
-    #csv_file.close()
-    dmm.close()
-    rm.close()
+    return np.concatenate(v_data_chunks)
 
-    print(f"Measurement complete - see 'V_DMM6500_v_{test_number}.csv' (in relative folder) for output.")
+def wait_for_buffer(dmm, target_count, pbar, poll_stats, start_count=0):
+    """
+    Waits until 'vDataBuffer' holds at least 'target_count' readings, sending one ':TRAC:ACTUAL?' query per poll.
+    Once the buffer is filling, the completion time is predicted from 'sample_rate' and the waiter sleeps until then.
+    While waiting for the trigger the poll interval backs off exponentially up to 'max_poll_interval'.
+    Poll count and wasted wait time (time between predicted completion and the poll that saw it) are added to 'poll_stats'.
+    The buffer only counts as filling once it holds more than 'start_count' readings (readings from earlier bursts).
+    Returns the number of readings stored.
+    """
+    poll_interval = min_poll_interval
+    predicted_time = None                                               # Predicted time at which 'target_count' is reached
+    deadline = None                                                     # Capture abandoned if not complete by this time
+
+    while True:
+        num_stored = int(dmm.query(":TRAC:ACTUAL? 'vDataBuffer'"))
+        poll_time = time.monotonic()
+        poll_stats["polls"] += 1
+        pbar.update(min(num_stored - start_count, pbar.total) - pbar.n)
+
+        if num_stored >= target_count:
+            if poll_stats.get("trigger_time") is None:
+                poll_stats["trigger_time"] = time.time() - min(num_stored - start_count, num_samples) / sample_rate
+            if predicted_time is not None:
+                poll_stats["wasted_s"] += max(0.0, poll_time - predicted_time)
+            return num_stored
+
+        if num_stored > start_count:
+            # Buffer filling - estimate trigger time from the readings already stored on first sight
+            if poll_stats.get("trigger_time") is None:
+                poll_stats["trigger_time"] = time.time() - (num_stored - start_count) / sample_rate
+
+            # Sleep until the remaining readings are predicted to be stored
+            predicted_time = poll_time + (target_count - num_stored) / sample_rate
+            if deadline is None:
+                deadline = predicted_time + capture_timeout
+            elif poll_time > deadline:
+                raise TimeoutError(f"'vDataBuffer' stalled at {num_stored} of {target_count} readings")
+            poll_interval = min(max(predicted_time - poll_time, min_poll_interval), max_poll_interval)
+        else:
+            # Waiting for trigger - back off
+            poll_interval = min(poll_interval * 2, max_poll_interval)
+
+        time.sleep(poll_interval)
+
+def read_buffer(dmm, start_index, end_index):
+    """
+    Reads buffer entries 'start_index' to 'end_index' (1-based, inclusive) from 'vDataBuffer'.
+    When 'binary_transfer' is set the readings arrive as a block of IEEE-754 doubles and are read straight into a
+    float64 array, otherwise the ASCII reply is converted with parse_data().
+    """
+    if binary_transfer:
+        return dmm.query_binary_values(f":TRAC:DATA? {start_index}, {end_index}, 'vDataBuffer', READ",
+                                       datatype='d', is_big_endian=False, container=np.array)
+
+    v_data = dmm.query(f":TRAC:DATA? {start_index}, {end_index}, 'vDataBuffer', READ")
+    v_data_floats, bad_mask = parse_data(v_data)			# Convert comma separated string into float64 array
+    if bad_mask.any():
+        print(f"Skipped {np.count_nonzero(bad_mask)} invalid readings in buffer entries {start_index} to {end_index}")
+    return v_data_floats
 
 def parse_data(v_data):
     """
-    Parses the current data array where each number is represented as a list of characters
-    and returns a list of floating-point numbers. Handles negative numbers and skips malformed entries.
+    Converts the comma separated ASCII reply from ':TRAC:DATA?' into a float64 array in a single vectorized pass.
+    Malformed entries are dropped from the returned readings rather than printed - 'bad_mask' flags them,
+    with one entry per comma separated token in the reply.
+    Returns (v_data_floats, bad_mask).
     """
-    v_data_floats = []
-
-    # First, join the list of characters into a string, then split by commas to separate each number
-    voltage_string = ''.join(v_data)  # Join all characters into a single string
+    voltage_string = v_data.strip()
+    num_tokens = voltage_string.count(',') + 1 if voltage_string else 0
 
-    # Split the string by commas to separate each voltage reading
-    voltage_entries = voltage_string.split(',')
-
-    for voltage_str in voltage_entries:
-        # Skip empty entries or malformed entries
-        if not voltage_str or voltage_str in ['-', '.', 'E', '-.', '.E', 'E-']:
-            print(f"Skipping invalid string: {voltage_str}")
-            continue
-        
-        # Try to convert the valid voltage string to a float
+    # Fast path - whole reply converted in C (numpy warns, rather than raising, if it stops early on a malformed entry)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            v_data_floats = np.fromstring(voltage_string, dtype=np.float64, sep=',')
+            if v_data_floats.size == num_tokens:
+                return v_data_floats, np.zeros(num_tokens, dtype=bool)
+        except (DeprecationWarning, ValueError):
+            pass
+
+    # Slow path - only taken when the reply contains malformed entries
+    voltage_entries = voltage_string.split(',') if voltage_string else []
+    v_data_floats = np.empty(num_tokens)
+    bad_mask = np.ones(num_tokens, dtype=bool)
+    for index, voltage_str in enumerate(voltage_entries):
         try:
-            voltage_float = float(voltage_str)
-            v_data_floats.append(voltage_float)
+            v_data_floats[index] = float(voltage_str)
+            bad_mask[index] = False
         except ValueError:
-            print(f"Error converting voltage string to float: {voltage_str}")
+            pass
 
-    return v_data_floats
+    return v_data_floats[~bad_mask], bad_mask
     
 
 if __name__ == "__main__":
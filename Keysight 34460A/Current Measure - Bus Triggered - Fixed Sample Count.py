@@ -5,13 +5,21 @@
 #
 #   - Author: Stuart Thomas
 #   - Date: 14/01/2025
-#   - Version: 1.0
+#   - Version: 1.2
+#    - Changelog: 1.0 -> 1.1
+#          - Test numbers allocated with allocate_test_number() - unique across concurrent processes/stations sharing the same directory
+#    - Changelog: 1.1 -> 1.2
+#          - Burst mode added (default) - sample timer/count set on the DMM and fired with a single bus trigger, readings drained in bulk with 'R?'
+#          - Sample interval now timed by the DMM rather than by READ? round trips + sleep(1/fs), so Fs is exact and does not drift
+#          - Legacy (burst_mode = False) loop paced by DeadlineScheduler (absolute monotonic deadlines) - no drift, overruns/jitter reported
+#          - Burst reading memory drained when about half full, with a timeout ('burst_timeout') if the burst does not complete
 #   - Description: - This program sets up DC current measurements on a Keysight 34460A. Settings are shown below...
 #                  - Default Settings:
 #                       - Trigger source: BUS
 #                       - Default number of readings: 2000          User selectable - change 'user_num_cycles' variable
 #                       - Fs = 100Hz                                User selectable - change 'fs' variable
 #                       - Results transferred to a .csv file upon reading completion
+#                       - Burst mode: ON                            User selectable - change 'burst_mode' variable (OFF = one READ? per sample)
 #                  - Equipment Required:
 #                       - Keysight 34460A DMM  (default)
 #                  - File structure/Pre-requisites:
@@ -24,24 +32,112 @@ import pyvisa
 import os
 from datetime import datetime
 
-def check_and_create_test_number_file(file_path='test_number.txt'):
-    if not os.path.exists(file_path):
-        with open(file_path, 'w') as file:
-            file.write('1')
-        print(f"{file_path} not found, File created and initialised to 1.")
+# Reading memory drained in blocks of this many readings during a burst (34460A standard reading memory holds 1,000 readings)
+burst_block_size = 1000
+
+# Reading memory checked once it is about half full (burst_block_size / (2 * fs)), and at this interval (s) once the burst should be complete
+burst_min_poll_interval = 0.05
+
+# Burst abandoned if not complete this long (s) after its expected end (num_samples / fs)
+burst_timeout = 10
+
+class DeadlineScheduler:
+    # Paces a fixed-rate loop on absolute deadlines (start + n * period) - no drift, overruns skip missed periods, jitter tracked
+    def __init__(self, period, spin_threshold=0.002):
+        self.period = period
+        self.spin_threshold = spin_threshold
+        self.start_time = None
+        self.deadline = None
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter_mean = 0.0
+        self.jitter_m2 = 0.0
+        self.jitter_max = 0.0
+
+    def wait(self):
+        # Blocks until the next deadline and returns it (first call starts the schedule) - sleeps, then spins the last 'spin_threshold'
+        now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = self.deadline = now
+        else:
+            self.deadline += self.period
+            if now > self.deadline:
+                # Overrun - previous iteration took longer than one period, skip any whole periods missed
+                self.overruns += 1
+                missed = int((now - self.deadline) // self.period)
+                self.skipped += missed
+                self.deadline += missed * self.period
+            else:
+                remaining = self.deadline - now
+                if remaining > self.spin_threshold:
+                    time.sleep(remaining - self.spin_threshold)
+                while time.perf_counter() < self.deadline:
+                    pass
+
+        # Running jitter statistics (Welford)
+        jitter = time.perf_counter() - self.deadline
+        self.ticks += 1
+        delta = jitter - self.jitter_mean
+        self.jitter_mean += delta / self.ticks
+        self.jitter_m2 += delta * (jitter - self.jitter_mean)
+        self.jitter_max = max(self.jitter_max, jitter)
+        return self.deadline
+
+    def summary(self):
+        # One line report of target vs. achieved rate, overruns and jitter
+        if self.ticks < 2:
+            return "Scheduler: not enough samples for rate statistics"
+        achieved_rate = (self.ticks - 1) / (self.deadline - self.start_time)
+        jitter_std = (self.jitter_m2 / (self.ticks - 1)) ** 0.5
+        return (f"Scheduler: target {1 / self.period:.3f} Hz, achieved {achieved_rate:.3f} Hz over {self.ticks} samples | "
+                f"overruns: {self.overruns} ({self.skipped} samples skipped) | "
+                f"jitter mean {self.jitter_mean * 1e3:.3f} ms, std {jitter_std * 1e3:.3f} ms, max {self.jitter_max * 1e3:.3f} ms")
+
+def allocate_test_number(file_path='test_number.txt'):
+    """
+    Allocates the next unique test number - safe for several capture processes/stations sharing the same directory.
+    Each number is claimed by atomically creating a marker file in '<file_path>.claims' (exclusive create only
+    succeeds for one process), so no lock is taken and concurrent writers never wait on each other.
+    'file_path' only holds a hint of the next free number, so existing test number files carry on from their current value.
+    """
+    claims_dir = file_path + ".claims"
+    os.makedirs(claims_dir, exist_ok=True)
+
+    # Start from hint of next free number (fall back to highest claimed number if hint is missing)
+    try:
+        with open(file_path, 'r') as file:
+            test_number = int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        claimed = [int(name) for name in os.listdir(claims_dir) if name.isdigit()]
+        test_number = max(claimed, default=0) + 1
+
+    # Claim first free number at or above the hint
+    while True:
+        try:
+            os.close(os.open(os.path.join(claims_dir, str(test_number)), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            test_number += 1
+
+    # Advance hint - never moved back by a slower process, and written to a temporary file then renamed so it is never read half written.
+    # (Two processes can still race between the check and the rename - a stale hint only costs extra claim attempts, as numbers are
+    # always claimed in order from the hint, so they stay unique and increasing)
+    try:
+        with open(file_path, 'r') as file:
+            current_hint = int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        current_hint = 0
+    if test_number + 1 > current_hint:
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            file.write(str(test_number + 1))
+        os.replace(temp_path, file_path)
 
-def read_test_number(file_path='test_number.txt'):
-    with open(file_path, 'r') as file:
-        test_number = int(file.read().strip())
     return test_number
-    
-def update_test_number(test_number, file_path='test_number.txt'):
-    with open (file_path, 'w') as file:
-        file.write(str(test_number))
 
 def save_current_values_to_csv(current_values):
-    check_and_create_test_number_file()
-    test_number = read_test_number()
+    test_number = allocate_test_number()
     current_date = datetime.now().strftime('%d-%m-%Y')
     filename = f"CURRENT-MEASURE_{test_number:04d}_{current_date}.csv"
     
@@ -52,8 +148,58 @@ def save_current_values_to_csv(current_values):
             writer.writerow([value])
     print(f"Data saved to {filename}")
     
-    update_test_number(test_number + 1)
-    
+
+def strip_block_header(reply):
+    """
+    Removes the IEEE-488.2 definite-length block header ('#<n><length>') from a reply to 'R?' and returns the block contents.
+    """
+    if not reply.startswith('#'):
+        return reply
+    num_digits = int(reply[1])
+    block_length = int(reply[2:2 + num_digits])
+    return reply[2 + num_digits:2 + num_digits + block_length]
+
+def burst_acquire(dmm, num_samples, fs):
+    """
+    Takes 'num_samples' readings timed by the DMM's sample timer at 'fs', started with a single bus trigger.
+    Reading memory is drained with 'R?' while the burst runs, so bursts longer than the reading memory are not lost.
+    Drains are spaced so the reading memory is about half full each time (a few transfers per burst, not one per poll).
+    Returns the list of readings. Raises TimeoutError if the burst is not complete 'burst_timeout' seconds after its expected end.
+    """
+    dmm.write("TRIG:SOUR BUS")                                  #one bus trigger starts the whole burst
+    dmm.write("TRIG:COUN 1")
+    dmm.write("SAMP:SOUR TIM")                                  #samples spaced by the DMM's sample timer
+    dmm.write(f"SAMP:TIM {1/fs}")
+    dmm.write(f"SAMP:COUN {num_samples}")
+
+    dmm.write("INIT")                                           #DMM enters wait-for-trigger state
+    dmm.write("*TRG")
+    start_time = time.perf_counter()
+    drain_interval = burst_block_size / (2 * fs)                #reading memory about half full between drains
+    end_time = start_time + num_samples / fs                    #expected end of the burst
+    deadline = end_time + burst_timeout
+
+    values = []
+    transactions = 0
+    while len(values) < num_samples:
+        now = time.perf_counter()
+        if now > deadline:
+            dmm.write("ABOR")
+            raise TimeoutError(f"Burst incomplete - {len(values)} / {num_samples} readings after {now - start_time:.1f} s")
+        time.sleep(min(drain_interval, max(end_time - now, burst_min_poll_interval)))
+
+        transactions = transactions + 1
+        if int(dmm.query("DATA:POIN?")) == 0:
+            continue
+        block = strip_block_header(dmm.query(f"R? {burst_block_size}"))
+        values += [float(value) for value in block.split(',') if value]
+        transactions = transactions + 1
+        print(f"{len(values)} / {num_samples}")
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Burst complete - {num_samples} readings at {fs} Hz in {elapsed:.2f} s ({transactions} transactions)")
+    return values
+
 
 def main():
     ## SETUP ###########
@@ -76,6 +222,7 @@ def main():
     print("         - Default number of readings: 2000          User selectable - change 'user_num_cycles' variable")
     print("         - Fs = 100Hz                                User selectable - change 'fs' variable")
     print("         - Results transferred to a .csv file upon reading completion")
+    print("         - Burst mode: ON                            User selectable - change 'burst_mode' variable (OFF = one READ? per sample)")
     print("\n")
     print("     Equipment required (all must be LXI/VISA capable):")
     print("         - Digital multimeter - Keysight 34460A used by default")
@@ -107,6 +254,7 @@ def main():
         
         user_num_cycles = 2000                                  #ENTER YOUR PREFFERED CYCLE AMOUNT HERE
         fs = 100                                                #ENTER YOUR PREFFERED SAMPLE FREQUENCY HERE
+        burst_mode = True                                       #True = DMM-timed burst, False = one READ? per sample (legacy)
         
         num_cycles = 0
         
@@ -121,13 +269,18 @@ def main():
         print("Press 'ENTER' to begin readings, or close program to exit.")
         input()
         
-        print("Taking ",num_cycles, " Readings")
-        while(num_cycles < user_num_cycles):
-            reading = float(dmm.query("READ?"))
-            current_values.append(reading)
-            time.sleep(1/fs)                                        
-            num_cycles = num_cycles + 1
-            print(num_cycles)
+        print("Taking ",user_num_cycles, " Readings")
+        if burst_mode:
+            current_values = burst_acquire(dmm, user_num_cycles, fs)
+        else:
+            scheduler = DeadlineScheduler(1/fs)                 #readings paced on absolute deadlines
+            while(num_cycles < user_num_cycles):
+                scheduler.wait()
+                reading = float(dmm.query("READ?"))
+                current_values.append(reading)
+                num_cycles = num_cycles + 1
+                print(num_cycles)
+            print(scheduler.summary())
 
         save_current_values_to_csv(current_values)              #save to .csv
 
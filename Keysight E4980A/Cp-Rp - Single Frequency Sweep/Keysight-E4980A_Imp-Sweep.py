@@ -5,18 +5,147 @@
 #
 #   - Author: Stuart Thomas
 #   - Date: 03/05/2024
-#   - Version: 1.0
+#   - Version: 1.3
+#    - Changelog: 1.0 -> 1.1
+#          - List sweep mode added (default) - frequencies loaded into the list sweep table once, all points measured with a single trigger and
+#            returned in one reply (2 bus transactions per sweep rather than 21)
+#          - Point-by-point sweep kept - change 'list_sweep' variable
+#    - Changelog: 1.1 -> 1.2
+#          - Binary REAL data format added (default) - replies decoded straight into numpy arrays by decode_measurement()
+#            (8 bytes per value rather than ~13 ASCII characters + separator) - change 'data_format' variable for ASCII
+#          - Measurement status separated from the Cp-Rp values, and any non-zero status (bridge unbalanced, signal source overload...) is reported
+#    - Changelog: 1.2 -> 1.3
+#          - Per-frequency aperture/averaging profile (written by the Impedance vs. Temperature auto-tune mode) used if present
+#                - One setting for all frequencies is applied once (list sweep still used), otherwise the sweep is point-by-point
+#                - Read from the Impedance vs. Temperature results folder (where the auto-tune saves it), or the path given on the command line
 #   - Description: This program connects to a Keysight E4980A LCR meter via. LAN, and activates a Cp-Rp single sweep measurement across the following frequencies: 20Hz, 100Hz, 1kHz, 10kHz, 100kHz, 1MHz, 2MHz.
 
 
 
 
+import json
+import os
+import sys
+import time
+import numpy as np
 import pyvisa
 
+# Sweep frequencies (Hz)
+frequencies = [20, 100, 1000, 10000, 100000, 1000000, 2000000]
+
+# True = list sweep (one trigger measures every frequency), False = one ':FREQ:CW', ':INIT', '*TRG' per frequency
+list_sweep = True
+
+# Aperture/averaging profile written by the Impedance vs. Temperature auto-tune mode - used if the file exists
+# Same folder as the Impedance vs. Temperature 'results_dir' (or its script folder, if that does not exist on this machine)
+# A different profile can be given on the command line:  py Keysight-E4980A_Imp-Sweep.py <aperture profile .json>
+aperture_profile_dir = "/home/napierats/Documents/Automated Test System/SCPI Programs/Imp-vs-temp"
+if not os.path.isdir(aperture_profile_dir):
+    aperture_profile_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Multi-Instrument", "Impedance vs. Temperature 1"))
+aperture_profile_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(aperture_profile_dir, "aperture_profile.json")
+
+# Aperture/averaging used for any frequency missing from the profile (instrument default after '*RST')
+default_aperture = "MED,1"
+
+# Measurement data format - "REAL" (64-bit binary, default) or "ASCII"
+data_format = "REAL"
+
+# Measurement status codes (see manual - ':FETCh?')
+MEASUREMENT_STATUS = {-1: "No data", 0: "Normal", 1: "Analog bridge unbalanced", 2: "A/D converter not working", 3: "Signal source overloaded", 4: "ALC unable to regulate"}
+
+def decode_measurement(reply, num_points):
+    """
+    Decodes a measurement reply (one or more points) into (values, status).
+    'reply' is the raw bytes of a REAL reply (#0 indefinite length block of big-endian float64) or an ASCII reply string.
+    'values' is a (num_points, 2) float array of data A, data B (Cp, Rp) and 'status' a (num_points,) int array.
+    """
+    if isinstance(reply, bytes):
+        # Block header - '#0' (indefinite length, ends with newline) or '#<n><length>'
+        num_digits = int(reply[1:2])
+        if num_digits == 0:
+            block = reply[2:]
+            block = block[:len(block) // 8 * 8]                 # Drop terminating newline
+        else:
+            block_length = int(reply[2:2 + num_digits])
+            block = reply[2 + num_digits:2 + num_digits + block_length]
+        data = np.frombuffer(block, dtype='>f8')
+    else:
+        data = np.array(reply.split(','), dtype=np.float64)
+
+    # Each point returns data A, data B, status (and a comparator result when enabled)
+    data = data.reshape(num_points, -1)
+    return data[:, :2], data[:, 2].astype(int)
+
+def read_measurement(lcr, num_points):
+    """
+    Triggers a measurement (single point or list sweep) and returns the decoded (values, status).
+    """
+    if data_format == "REAL":
+        lcr.write("*TRG")
+        return decode_measurement(lcr.read_raw(), num_points)
+    return decode_measurement(lcr.query("*TRG"), num_points)
+
+def check_status(frequencies, status):
+    for frequency, point_status in zip(frequencies, status):
+        if point_status != 0:
+            print(f"WARNING - {frequency} Hz measurement status: {MEASUREMENT_STATUS.get(point_status, point_status)}")
+
+def load_aperture_profile(frequencies):
+    """
+    Returns {frequency: "<aperture>,<averaging>"} from the aperture profile file for the sweep frequencies (empty if there is no profile).
+    Frequencies missing from the profile are given 'default_aperture', so they never inherit the previous point's setting.
+    """
+    if not os.path.exists(aperture_profile_path):
+        print(f"No aperture profile found at {aperture_profile_path} - instrument default aperture used")
+        return {}
+    with open(aperture_profile_path, "r") as file:
+        profile = json.load(file)
+    aperture_settings = {point["frequency"]: f"{point['aperture']},{point['averaging']}" for point in profile["points"] if point["frequency"] in frequencies}
+
+    missing = [frequency for frequency in frequencies if frequency not in aperture_settings]
+    if missing and aperture_settings:
+        print(f"WARNING - no tuned setting for {missing} Hz - {default_aperture} used (re-run the auto-tune to tune them)")
+        for frequency in missing:
+            aperture_settings[frequency] = default_aperture
+    return aperture_settings
+
+def setup_list_sweep(lcr, frequencies):
+    """
+    Loads 'frequencies' into the E4980A list sweep table, set to sweep every point sequentially from a single trigger.
+    """
+    lcr.write(":DISP:PAGE LIST")                                # List sweep only runs from the LIST SWEEP display page
+    lcr.write(":LIST:MODE SEQ")                                 # One trigger measures every point in the table
+    lcr.write(":LIST:FREQ " + ",".join(str(frequency) for frequency in frequencies))
+
+def list_sweep_measure(lcr, num_points):
+    """
+    Triggers one list sweep and returns (values, status) - one (Cp, Rp) row and status per point in the list sweep table.
+    """
+    lcr.write(":INIT")                                          # Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
+    return read_measurement(lcr, num_points)
+
+def point_sweep_measure(lcr, frequencies, aperture_settings=None):
+    """
+    Measures each frequency in turn with its own trigger and returns (values, status) - one (Cp, Rp) row and status per frequency.
+    Frequencies in 'aperture_settings' are measured with their tuned aperture/averaging.
+    """
+    values = np.empty((len(frequencies), 2))
+    status = np.empty(len(frequencies), dtype=int)
+    for index, frequency in enumerate(frequencies):
+        lcr.write(f":FREQ:CW {frequency}")
+        if aperture_settings:
+            lcr.write(f":APER {aperture_settings.get(frequency, default_aperture)}")
+        lcr.write(":INIT")                                      # Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
+        point_values, point_status = read_measurement(lcr, 1)   # Take impedance measurement
+        values[index] = point_values[0]
+        status[index] = point_status[0]
+    return values, status
+
 def main():
     # Connect to the Keysight E4980 LCR Meter
     rm = pyvisa.ResourceManager()
     lcr = rm.open_resource('TCPIP0::K-E4980A-22227.local::inst0::INSTR')  # Replace with your instrument's VISA address
+    lcr.timeout = 10000                                         # Whole sweep returned in one reply - allow for the 20Hz point
     
     # Reset meter
     lcr.write("*RST")
@@ -29,52 +158,33 @@ def main():
     # Setup LCR for Cp-Rp measurements
     lcr.write(":FUNC:IMP:TYPE CPRP")
 
-    # Change output data type to ASCII
-    lcr.write(":FORMAT:DATA ASCII")
+    # Set output data type - binary REAL (64-bit) or ASCII
+    lcr.write(f":FORMAT:DATA {data_format}")
+
+    # Tuned aperture/averaging - a list sweep uses one setting for every point, so a per-frequency profile needs a point-by-point sweep
+    aperture_settings = load_aperture_profile(frequencies)
+    use_list_sweep = list_sweep
+    if aperture_settings:
+        print(f"Aperture profile loaded from {aperture_profile_path} - {aperture_settings}")
+        if len(set(aperture_settings.values())) == 1 and len(aperture_settings) == len(frequencies):
+            lcr.write(f":APER {aperture_settings[frequencies[0]]}")
+            aperture_settings = {}
+        else:
+            use_list_sweep = False
 
     try:
-	    # Set initial frequency - 20Hz Reading
-        lcr.write(":FREQ:CW 20")
-        lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-        imp = lcr.query("*TRG")					# Take impedance measurement
-        print("Impedance:", imp, "\n")
-
-        # 100Hz Reading
-        lcr.write(":FREQ:CW 100")
-        lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-        imp = lcr.query("*TRG")					# Take impedance measurement
-        print("Impedance:", imp, "\n")
-
-        # 1kHz Reading
-        lcr.write(":FREQ:CW 1000")
-        lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-        imp = lcr.query("*TRG")					# Take impedance measurement
-        print("Impedance:", imp, "\n")
-
-        # 10kHz Reading
-        lcr.write(":FREQ:CW 10000")
-        lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-        imp = lcr.query("*TRG")					# Take impedance measurement
-        print("Impedance:", imp, "\n")
-
-        # 100kHz Reading
-        lcr.write(":FREQ:CW 100000")
-        lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-        imp = lcr.query("*TRG")					# Take impedance measurement
-        print("Impedance:", imp, "\n")
-
-        # 1MHz Reading
-        lcr.write(":FREQ:CW 1000000")
-        lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-        imp = lcr.query("*TRG")					# Take impedance measurement
-        print("Impedance:", imp, "\n")
-
-        # 2MHz Reading
-        lcr.write(":FREQ:CW 2000000")
-        lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-        imp = lcr.query("*TRG")					# Take impedance measurement
-        print("Impedance:", imp, "\n")
-        
+        start_time = time.perf_counter()
+        if use_list_sweep:
+            setup_list_sweep(lcr, frequencies)
+            values, status = list_sweep_measure(lcr, len(frequencies))
+        else:
+            values, status = point_sweep_measure(lcr, frequencies, aperture_settings)
+        sweep_time = time.perf_counter() - start_time
+
+        check_status(frequencies, status)
+        for frequency, (cp, rp) in zip(frequencies, values):
+            print(f"{frequency} Hz - Impedance: Cp = {cp} F, Rp = {rp} Ohms\n")
+        print(f"Sweep time: {sweep_time:.3f} s ({'list' if use_list_sweep else 'point-by-point'} sweep)\n")
 
         # Keep the script running until manually terminated
         input("Press Enter to exit...")
@@ -5,7 +5,27 @@
 #
 #   - Author: Stuart Thomas
 #   - Date: 15/01/2025
-#   - Version: 1.0
+#   - Version: 1.5
+#    - Changelog: 1.0 -> 1.1
+#          - Test numbers allocated with allocate_test_number() - unique across concurrent processes/stations sharing the same directory
+#    - Changelog: 1.1 -> 1.2
+#          - process_scope_data() replaced with read_scope_waveform()/decode_scope_waveform() - O(n), numpy based
+#          - IEEE-488.2 block read by its length with query_binary_values() (was a fixed 10 character strip) - point count checked against ':WAV:PRE?'
+#          - Scope waveform transferred as binary WORD by default (BYTE/ASCII selectable), scaled to volts with ':WAV:PRE?'
+#                - User selectable - change 'scope_waveform_format' variable
+#    - Changelog: 1.2 -> 1.3
+#          - Fixed 10 s + 50 s waits for the scope replaced with acquisition-done polling (':ADER?'), with a timeout
+#          - Scope started with ':SINGle' rather than ':DIG' (':DIG' blocks the scope's command parser, so it cannot be polled)
+#          - Time saved against the old fixed 60 s wait is printed for each run
+#    - Changelog: 1.3 -> 1.4
+#          - DMM sampling and scope acquisition/transfer run as concurrent threads (acquire_current()/acquire_voltage()), each on its own session
+#          - Both tasks released together with a barrier - scope waveform download overlaps the end of the DMM readings
+#          - Run time per test is now roughly the longer of the two acquisitions (task and total times printed)
+#    - Changelog: 1.4 -> 1.5
+#          - DMM readings host-timestamped (midpoint of each READ? round trip), scope time axis built from ':WAV:PRE?' and the ':SINGle' host time
+#          - Both series interpolated onto one common time axis (align_series()) over the period both cover - replaces zero padding
+#                - Resample rate defaults to the faster of the two series - change 'resample_rate' variable to fix it
+#          - Output .csv now has a time column, and measured per-sample rate statistics (mean Fs, interval std/min/max) for each series
 #   - Description: - This program sets up DC current and voltage measurements on a Keysight 34460A. Settings are shown below...
 #                  - Default Settings:
 #                       - Trigger source: BUS
@@ -23,73 +43,248 @@ import csv
 import time
 import pyvisa
 import os
+import threading
 from datetime import datetime
+import numpy as np
 
-def process_scope_data(voltage_values):
-    
-    data = voltage_values[10:]          #strip header
-    
-    data_str = ''.join(data).replace(' ', '').replace('\n', '')     #clean up any spaces or newlines
-    numbers = []
-    
-    while data_str:
-        comma_index = data_str.find(',') if ',' in data_str else len(data_str)
-        number_str = data_str[:comma_index].strip()
-        
-        if number_str:
-            number = float(number_str)
-            numbers.append(f"{number:.16f}")
-            
-        data_str = data_str[comma_index + 1:]
-    return numbers
+# Scope waveform transfer format - "WORD" (16-bit, default), "BYTE" (8-bit, smallest transfer) or "ASCII" (slowest)
+scope_waveform_format = "WORD"
+
+# Maximum time to wait for the scope acquisition to complete after the DMM readings (s)
+scope_timeout = 180
+
+# Interval between scope acquisition-done checks (s)
+scope_poll_interval = 0.25
+
+# Fixed wait previously used after the DMM readings (s) - used to report time saved
+legacy_scope_wait = 60
+
+# Common time axis rate for the output file (Hz) - None = faster of the two measured series
+resample_rate = None
+
+# ':WAV:PRE?' format codes
+WAVEFORM_FORMATS = {0: "BYTE", 1: "WORD", 4: "ASCII"}
+
+def wait_for_scope_acquisition(scope, timeout=scope_timeout):
+    """
+    Polls the scope's acquisition done event register (':ADER?') until the acquisition started by ':SINGle' completes.
+    ':ADER?' must be read once before ':SINGle' to clear it. Returns the time spent waiting (s).
+    Raises TimeoutError if the acquisition has not completed within 'timeout' seconds.
+    """
+    start_time = time.perf_counter()
+    while int(scope.query(":ADER?")) != 1:
+        if time.perf_counter() - start_time > timeout:
+            raise TimeoutError(f"Scope acquisition did not complete within {timeout} s")
+        time.sleep(scope_poll_interval)
+    return time.perf_counter() - start_time
+
+def read_scope_waveform(scope):
+    """
+    Reads the current waveform from the scope in the format set by ':WAV:FORM' and returns (voltages, preamble).
+    'voltages' is a float64 array in volts, 'preamble' is a dict of the ':WAV:PRE?' fields (needed to build the time axis).
+    """
+    fields = scope.query(":WAV:PRE?").strip().split(',')
+    preamble = {
+        "format": WAVEFORM_FORMATS[int(fields[0])],
+        "type": int(fields[1]),
+        "points": int(fields[2]),
+        "count": int(fields[3]),
+        "x_increment": float(fields[4]),
+        "x_origin": float(fields[5]),
+        "x_reference": float(fields[6]),
+        "y_increment": float(fields[7]),
+        "y_origin": float(fields[8]),
+        "y_reference": float(fields[9]),
+    }
+
+    if preamble["format"] == "ASCII":
+        # Comma separated volts after the block header - no newlines inside the data, so a normal read returns the whole reply
+        reply = scope.query(":WAV:DATA?").strip()
+        voltages = np.array(reply[2 + int(reply[1]):].split(','), dtype=np.float64)
+    else:
+        # Binary block - read by length (the read termination character can appear inside BYTE/WORD data)
+        codes = scope.query_binary_values(":WAV:DATA?", datatype='B' if preamble["format"] == "BYTE" else 'H',
+                                          is_big_endian=False, container=np.array)
+        voltages = decode_scope_waveform(codes, preamble)
+
+    if len(voltages) != preamble["points"]:
+        raise ValueError(f"Scope waveform has {len(voltages)} points, preamble reports {preamble['points']}")
+    return voltages, preamble
+
+def decode_scope_waveform(codes, preamble):
+    """
+    Scales BYTE/WORD waveform codes to a float64 array of voltages with the preamble: V = (code - y_reference) * y_increment + y_origin.
+    WORD data must be sent LSB first and unsigned (':WAV:BYT LSBF', ':WAV:UNS 1').
+    """
+    return (codes - preamble["y_reference"]) * preamble["y_increment"] + preamble["y_origin"]
+
+def acquire_current(dmm, num_samples, start_barrier, results):
+    """
+    DMM task - takes 'num_samples' READ? readings once both tasks have reached 'start_barrier'.
+    Stores the readings, their host timestamps (perf_counter seconds) and task time in 'results' (or the exception, if one occurs).
+    """
+    try:
+        current_values = np.empty(num_samples)
+        current_times = np.empty(num_samples)
+        start_barrier.wait()
+        start_time = time.perf_counter()
+
+        #do current measurements - each reading timestamped at the midpoint of its round trip
+        for index in range(num_samples):
+            query_time = time.perf_counter()
+            readingC = float(dmm.query("READ?"))
+            current_times[index] = (query_time + time.perf_counter()) / 2
+            current_values[index] = readingC
+            print(index + 1,"    ",readingC)
+
+        results["current_values"] = current_values
+        results["current_times"] = current_times
+        results["task_time"] = time.perf_counter() - start_time
+    except Exception as error:
+        start_barrier.abort()                                   #release other task if this one fails before the start
+        results["error"] = error
+
+def acquire_voltage(scope, start_barrier, results):
+    """
+    Scope task - starts a single acquisition once both tasks have reached 'start_barrier', waits for it to complete and downloads the waveform.
+    Stores the voltages, their host time axis (perf_counter seconds), preamble and task time in 'results' (or the exception, if one occurs).
+    """
+    try:
+        scope.write("STOP")  
+        scope.write(":WAV:SOUR CHAN1")
+        scope.query(":ADER?")                                   #clear acquisition done event before starting
+        start_barrier.wait()
+        start_time = time.perf_counter()
+
+        #take scope readings - single acquisition - starts with current measurements
+        scope.write(":SINGle")
+        single_time = (start_time + time.perf_counter()) / 2
+        scope_wait = wait_for_scope_acquisition(scope)
+        print(f"Scope acquisition complete after {scope_wait:.1f} s - {legacy_scope_wait - scope_wait:.1f} s saved against fixed {legacy_scope_wait} s wait")
+
+        transfer_start = time.perf_counter()
+        results["voltage_values"], results["preamble"] = read_scope_waveform(scope)
+        results["voltage_times"] = scope_time_axis(results["preamble"], len(results["voltage_values"]), single_time)
+        print(f"Scope waveform transferred and decoded ({results['preamble']['format']}, {len(results['voltage_values'])} points) in {(time.perf_counter() - transfer_start) * 1e3:.1f} ms")
+        results["task_time"] = time.perf_counter() - start_time
+    except Exception as error:
+        start_barrier.abort()
+        results["error"] = error
+
+def scope_time_axis(preamble, num_points, trigger_time):
+    """
+    Returns the host time (perf_counter seconds) of each scope sample: trigger_time + (i - x_reference) * x_increment + x_origin.
+    The scope auto-triggers, so the host time of the ':SINGle' command is used as the trigger time.
+    """
+    return trigger_time + preamble["x_origin"] + (np.arange(num_points) - preamble["x_reference"]) * preamble["x_increment"]
 
-def check_and_create_test_number_file(file_path='test_number.txt'):
-    if not os.path.exists(file_path):
-        with open(file_path, 'w') as file:
-            file.write('1')
-        print(f"{file_path} not found, File created and initialised to 1.")
+def sample_rate_stats(times):
+    """
+    Returns the measured sample rate statistics of a timestamped series - mean Fs (Hz) and sample interval mean/std/min/max (s).
+    """
+    intervals = np.diff(times)
+    return {
+        "samples": len(times),
+        "mean_fs": 1 / intervals.mean(),
+        "interval_mean": intervals.mean(),
+        "interval_std": intervals.std(),
+        "interval_min": intervals.min(),
+        "interval_max": intervals.max(),
+    }
+
+def align_series(current_times, current_values, voltage_times, voltage_values, rate=None):
+    """
+    Linearly interpolates both series onto one common, evenly spaced time axis covering only the period both series span.
+    'rate' (Hz) defaults to the faster of the two series' mean sample rates.
+    Returns (times, currents, voltages) with times in seconds from the start of the common period.
+    """
+    start = max(current_times[0], voltage_times[0])
+    end = min(current_times[-1], voltage_times[-1])
+    if end <= start:
+        raise ValueError("Current and voltage series do not overlap in time")
+
+    if rate is None:
+        rate = max(sample_rate_stats(current_times)["mean_fs"], sample_rate_stats(voltage_times)["mean_fs"])
+    times = start + np.arange(int((end - start) * rate) + 1) / rate
+
+    return times - start, np.interp(times, current_times, current_values), np.interp(times, voltage_times, voltage_values)
+
+def allocate_test_number(file_path='test_number.txt'):
+    """
+    Allocates the next unique test number - safe for several capture processes/stations sharing the same directory.
+    Each number is claimed by atomically creating a marker file in '<file_path>.claims' (exclusive create only
+    succeeds for one process), so no lock is taken and concurrent writers never wait on each other.
+    'file_path' only holds a hint of the next free number, so existing test number files carry on from their current value.
+    """
+    claims_dir = file_path + ".claims"
+    os.makedirs(claims_dir, exist_ok=True)
+
+    # Start from hint of next free number (fall back to highest claimed number if hint is missing)
+    try:
+        with open(file_path, 'r') as file:
+            test_number = int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        claimed = [int(name) for name in os.listdir(claims_dir) if name.isdigit()]
+        test_number = max(claimed, default=0) + 1
+
+    # Claim first free number at or above the hint
+    while True:
+        try:
+            os.close(os.open(os.path.join(claims_dir, str(test_number)), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            test_number += 1
+
+    # Advance hint - never moved back by a slower process, and written to a temporary file then renamed so it is never read half written.
+    # (Two processes can still race between the check and the rename - a stale hint only costs extra claim attempts, as numbers are
+    # always claimed in order from the hint, so they stay unique and increasing)
+    try:
+        with open(file_path, 'r') as file:
+            current_hint = int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        current_hint = 0
+    if test_number + 1 > current_hint:
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            file.write(str(test_number + 1))
+        os.replace(temp_path, file_path)
 
-def read_test_number(file_path='test_number.txt'):
-    with open(file_path, 'r') as file:
-        test_number = int(file.read().strip())
     return test_number
     
-def update_test_number(test_number, file_path='test_number.txt'):
-    with open (file_path, 'w') as file:
-        file.write(str(test_number))
-    
-def save_current_and_voltage_to_csv(current_values, voltage_values, c_fs, v_fs):
-    check_and_create_test_number_file()
-    test_number = read_test_number()
+def save_current_and_voltage_to_csv(current_times, current_values, voltage_times, voltage_values):
+    test_number = allocate_test_number()
     current_date = datetime.now().strftime('%d-%m-%Y')
     
     filename = f"CURRENT-AND-VOLTAGE-MEASURE_{test_number:04d}_{current_date}.csv"
     
-    # Pad the shorter list with zeros to match the length of the longer list
-    max_length = max(len(current_values), len(voltage_values))
-    current_values += [0] * (max_length - len(current_values))
-    voltage_values += [0] * (max_length - len(voltage_values))
+    # Measured rate statistics, then both series resampled onto a common time axis
+    c_stats = sample_rate_stats(current_times)
+    v_stats = sample_rate_stats(voltage_times)
+    times, currents, voltages = align_series(current_times, current_values, voltage_times, voltage_values, resample_rate)
+    common_fs = (len(times) - 1) / times[-1] if len(times) > 1 else 0
     
     # Write the data to the CSV file
     with open(filename, mode='w', newline='') as file:
         writer = csv.writer(file)
         
-        # Write the sample rates for each (current and voltage)
-        writer.writerow(["Current FS (Hz)", "Voltage FS (Hz)"])
-        writer.writerow([c_fs, v_fs])
+        # Write the measured sample rate statistics for each (current and voltage)
+        writer.writerow(["", "Current", "Voltage"])
+        writer.writerow(["Samples", c_stats["samples"], v_stats["samples"]])
+        writer.writerow(["Mean FS (Hz)", c_stats["mean_fs"], v_stats["mean_fs"]])
+        writer.writerow(["Sample Interval Mean (s)", c_stats["interval_mean"], v_stats["interval_mean"]])
+        writer.writerow(["Sample Interval Std (s)", c_stats["interval_std"], v_stats["interval_std"]])
+        writer.writerow(["Sample Interval Min (s)", c_stats["interval_min"], v_stats["interval_min"]])
+        writer.writerow(["Sample Interval Max (s)", c_stats["interval_max"], v_stats["interval_max"]])
+        writer.writerow(["Resampled FS (Hz)", common_fs])
+        writer.writerow([])
         
         # Write the header row
-        writer.writerow(["Current Values (A)", "Voltage Values (V)"])
+        writer.writerow(["Time (s)", "Current Values (A)", "Voltage Values (V)"])
         
-        
-        # Write each pair of values to the CSV
-        for current, voltage in zip(current_values, voltage_values):
-            writer.writerow([current, voltage])
-    
-    print(f"Data saved to {filename}")
+        # Write each resampled (time, current, voltage) row to the CSV
+        np.savetxt(file, np.column_stack((times, currents, voltages)), delimiter=',', fmt='%.9g')
     
-    # Update the test number for future uses
-    update_test_number(test_number + 1)
+    print(f"Data saved to {filename} ({len(times)} rows at {common_fs:.3f} Hz, current mean FS {c_stats['mean_fs']:.3f} Hz, voltage mean FS {v_stats['mean_fs']:.3f} Hz)")
     
 
 def main():
@@ -153,11 +348,6 @@ def main():
         user_num_cycles = 6000                                  #ENTER YOUR PREFFERED CYCLE AMOUNT HERE
         #c_fs = 100                                                #ENTER YOUR PREFFERED SAMPLE FREQUENCY HERE
         
-        num_cycles = 0
-        
-        current_values = []
-        voltage_values = []
-        
         dmm.write("CONF:CURR:DC")                               #set to DC current measurement mode
         dmm.write("CURR:DC:NPLC 0.02")
         
@@ -167,7 +357,9 @@ def main():
         scope.write(":TIM:REF LEFT\n")
         scope.write(":TIMEBASE:MODE MAIN")
         scope.write(":ACQ:TYPE NORM\n")
-        scope.write(":WAV:FORM ASCII")
+        scope.write(f":WAV:FORM {scope_waveform_format}")
+        scope.write(":WAV:BYT LSBF")                            #WORD data - LSB first, unsigned (matches decode_scope_waveform())
+        scope.write(":WAV:UNS 1")
         scope.write(":WAV:POIN 50000")
         
         print("Scope Settings: 5s/div     1V/div      no trigger\n")
@@ -179,45 +371,32 @@ def main():
         print("Press 'ENTER' to begin readings, or close program to exit.")
         input()
         
-        print("Taking ",num_cycles, " Readings")
-        
-        scope.write("STOP")  
-        time.sleep(0.1)
-        #take scope readings - digitize - start reading just before current measurements
-        scope.write(":DIG CHAN1")
-        
-        start_time = datetime.now()
+        print("Taking ",user_num_cycles, " Readings")
+        print("Scope digitising waveform concurrently...")
         
+        #DMM and scope run as independent tasks, released together by the barrier
+        start_barrier = threading.Barrier(2)
+        dmm_results = {}
+        scope_results = {}
+        dmm_thread = threading.Thread(target=acquire_current, args=(dmm, user_num_cycles, start_barrier, dmm_results))
+        scope_thread = threading.Thread(target=acquire_voltage, args=(scope, start_barrier, scope_results))
         
-        #do current measurements
-        while(num_cycles < user_num_cycles):
-            readingC = float(dmm.query("READ?"))
-            current_values.append(readingC)
-            #time.sleep(0.04)                                                     #calculate fs rather than select                                        
-            num_cycles = num_cycles + 1
-            print(num_cycles,"    ",readingC)
-        
-        end_time = datetime.now()
-        
-        print(type(start_time))
-        print(type(end_time))
-        time.sleep(10)
-        
-        elapsed_time = end_time - start_time
-        elapsed_s = elapsed_time.total_seconds()
-        
-        c_fs = user_num_cycles / elapsed_s
-
-        print("Scope digitising waveform, please wait...")
-        time.sleep(50)
+        run_start = time.perf_counter()
+        dmm_thread.start()
+        scope_thread.start()
+        dmm_thread.join()
+        scope_thread.join()
+        run_time = time.perf_counter() - run_start
         
-        v_fs = scope.query(":ACQ:SRATE?")
+        #report the original failure rather than the other task's broken barrier
+        errors = [results["error"] for results in (dmm_results, scope_results) if "error" in results]
+        if errors:
+            raise next((error for error in errors if not isinstance(error, threading.BrokenBarrierError)), errors[0])
         
-        voltage_values = scope.query(":WAV:DATA?")  
-        output_voltage_values = process_scope_data(voltage_values)
-        #CONVERT VOLTAGE VALUES HERE
+        print(f"DMM task: {dmm_results['task_time']:.1f} s, scope task: {scope_results['task_time']:.1f} s, total (concurrent): {run_time:.1f} s")
         
-        save_current_and_voltage_to_csv(current_values, output_voltage_values, c_fs, v_fs)             #save to .csv
+        save_current_and_voltage_to_csv(dmm_results["current_times"], dmm_results["current_values"],
+                                        scope_results["voltage_times"], scope_results["voltage_values"])             #save to .csv
 
         print("Readings stored successfully, resetting in 5 seconds...")
         time.sleep(5)
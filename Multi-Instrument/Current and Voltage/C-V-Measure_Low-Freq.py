@@ -5,8 +5,18 @@
 #
 #   - Author: Stuart Thomas
 #   - Date: 27/01/2025
-#   - Version: 1.0
-#   - Changelog: 
+#   - Version: 1.3
+#   - Changelog: 1.0 -> 1.1
+#          - Readings paced by DeadlineScheduler (absolute monotonic deadlines) rather than sleep(sample_period) after each reading - no drift
+#          - Overruns, jitter and achieved sample rate reported on completion
+#          - Sample period may be fractional
+#   - Changelog: 1.1 -> 1.2
+#          - Current and voltage queried concurrently (one worker thread per instrument, released together by a barrier)
+#                - Cycle time is the longer of the two query latencies rather than their sum
+#          - Each reading timestamped (midpoint of its query), and V-I skew logged per sample - mean/max skew reported on completion
+#   - Changelog: 1.2 -> 1.3
+#          - Readings logged with RotatingCsvLogger - rows batched and written by a background thread (no flush per row)
+#          - Output split into numbered files (CV_Log_001.csv...) by size/age - change 'log_' variables
 #   - Description: - Program takes sequential current readings and voltage measurements.
 #                   - Users can specify the sample rate and number of samples to read (<10Hz).
 #                   - Output data is stored as a .csv file with each entry being a double precision float.
@@ -14,9 +24,159 @@
 #                   - Default Voltage Measurement device:    Keysight 34460A
 
 import csv
+import os
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import pyvisa
 
+# Log file settings - rows are flushed to disk every 'log_flush_interval' seconds or 'log_flush_rows' rows,
+# and a new numbered file is started every 'log_max_bytes' bytes or 'log_max_age' seconds (None = no limit)
+log_flush_interval = 1.0
+log_flush_rows = 100
+log_max_bytes = 100e6
+log_max_age = 24 * 60 * 60
+
+class DeadlineScheduler:
+    # Paces a fixed-rate loop on absolute deadlines (start + n * period) - no drift, overruns skip missed periods, jitter tracked
+    def __init__(self, period, spin_threshold=0.002):
+        self.period = period
+        self.spin_threshold = spin_threshold
+        self.start_time = None
+        self.deadline = None
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter_mean = 0.0
+        self.jitter_m2 = 0.0
+        self.jitter_max = 0.0
+
+    def wait(self):
+        # Blocks until the next deadline and returns it (first call starts the schedule) - sleeps, then spins the last 'spin_threshold'
+        now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = self.deadline = now
+        else:
+            self.deadline += self.period
+            if now > self.deadline:
+                # Overrun - previous iteration took longer than one period, skip any whole periods missed
+                self.overruns += 1
+                missed = int((now - self.deadline) // self.period)
+                self.skipped += missed
+                self.deadline += missed * self.period
+            else:
+                remaining = self.deadline - now
+                if remaining > self.spin_threshold:
+                    time.sleep(remaining - self.spin_threshold)
+                while time.perf_counter() < self.deadline:
+                    pass
+
+        # Running jitter statistics (Welford)
+        jitter = time.perf_counter() - self.deadline
+        self.ticks += 1
+        delta = jitter - self.jitter_mean
+        self.jitter_mean += delta / self.ticks
+        self.jitter_m2 += delta * (jitter - self.jitter_mean)
+        self.jitter_max = max(self.jitter_max, jitter)
+        return self.deadline
+
+    def summary(self):
+        # One line report of target vs. achieved rate, overruns and jitter
+        if self.ticks < 2:
+            return "Scheduler: not enough samples for rate statistics"
+        achieved_rate = (self.ticks - 1) / (self.deadline - self.start_time)
+        jitter_std = (self.jitter_m2 / (self.ticks - 1)) ** 0.5
+        return (f"Scheduler: target {1 / self.period:.3f} Hz, achieved {achieved_rate:.3f} Hz over {self.ticks} samples | "
+                f"overruns: {self.overruns} ({self.skipped} samples skipped) | "
+                f"jitter mean {self.jitter_mean * 1e3:.3f} ms, std {jitter_std * 1e3:.3f} ms, max {self.jitter_max * 1e3:.3f} ms")
+
+class RotatingCsvLogger:
+    # .csv logger - writerow() only queues the row, a background thread writes batches every 'flush_interval' s or 'flush_rows' rows
+    # Output split into numbered files (<name>_001.csv...) every 'max_bytes' bytes or 'max_age' seconds (None = no limit)
+    def __init__(self, filename, header, flush_interval=1.0, flush_rows=100, max_bytes=100e6, max_age=None):
+        self.base_name, self.extension = os.path.splitext(filename)
+        self.header = header
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.file_index = 0
+        self.file = None
+        self.filenames = []
+        self.error = None
+        self.rows = queue.Queue()
+        self.thread = threading.Thread(target=self.write_rows, daemon=True)
+        self.thread.start()
+
+    def writerow(self, row):
+        if self.error is not None:
+            raise self.error
+        self.rows.put(row)
+
+    def close(self):
+        # Writes any queued rows, closes the current file and stops the writer thread
+        self.rows.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def open_next_file(self):
+        if self.file is not None:
+            self.file.close()
+        self.file_index += 1
+        filename = f"{self.base_name}_{self.file_index:03d}{self.extension}"
+        self.file = open(filename, "w", newline='')
+        self.csv_writer = csv.writer(self.file)
+        self.csv_writer.writerow(self.header)
+        self.file_opened = time.monotonic()
+        self.filenames.append(filename)
+
+    def write_batch(self, batch):
+        if self.file is None or self.file.tell() >= self.max_bytes or \
+                (self.max_age is not None and time.monotonic() - self.file_opened >= self.max_age):
+            self.open_next_file()
+        self.csv_writer.writerows(batch)
+        self.file.flush()
+
+    def write_rows(self):
+        # Writer thread
+        batch = []
+        last_flush = time.monotonic()
+        running = True
+        try:
+            while running:
+                try:
+                    row = self.rows.get(timeout=max(0, self.flush_interval - (time.monotonic() - last_flush)))
+                    if row is None:
+                        running = False
+                    else:
+                        batch.append(row)
+                except queue.Empty:
+                    pass
+
+                if batch and (not running or len(batch) >= self.flush_rows or time.monotonic() - last_flush >= self.flush_interval):
+                    self.write_batch(batch)
+                    batch = []
+                if not batch:
+                    last_flush = time.monotonic()
+        except Exception as error:
+            self.error = error
+        finally:
+            if self.file is not None:
+                self.file.close()
+
+def timed_query(instrument, command, barrier):
+    """
+    Waits at 'barrier' so both instruments are queried at the same instant, then queries 'command'.
+    Returns (reading, timestamp) - the timestamp (perf_counter seconds) is the midpoint of the query round trip.
+    """
+    barrier.wait()
+    query_time = time.perf_counter()
+    reading = float(instrument.query(command))
+    return reading, (query_time + time.perf_counter()) / 2
+
+
 # Program description
 print("\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n")
 print("-------------------------------------------------------------------------------------")
@@ -27,7 +187,7 @@ print("-------------------------------------------------------------------------
 print("\n")
 print("    - Author: Stuart Thomas")
 print("    - Date: 27/01/2025")
-print("    - Version: 1.0")
+print("    - Version: 1.3")
 print("    - Description:")
 print("        - Program takes sequential current readings and voltage measurements.")
 print("        - Users can specify the sample rate and number of samples to read (<10Hz).")
@@ -56,7 +216,7 @@ input("Press any key when complete...")
 print("\n\n")
 
 # Prompt user to set sample rate
-sample_period = int(input("Please enter the desired sample period (in seconds): "))
+sample_period = float(input("Please enter the desired sample period (in seconds): "))
 print("\n\n")
 
 # Prompt user to set number of samples
@@ -78,30 +238,40 @@ def main():
     dmm_v.write("CONF:VOLT:DC")                               #set to DC voltage measurement mode
 
     # Create CSV file for logging
-    csv_file = open("CV_Log.csv", "w", newline='')
-    csv_writer = csv.writer(csv_file)
-    csv_writer.writerow(["Timestamp", "Current (A)", "Voltage (V)"])
+    csv_logger = RotatingCsvLogger("CV_Log.csv", ["Timestamp", "Current (A)", "Voltage (V)", "Current Time (s)", "Voltage Time (s)", "V-I Skew (ms)"],
+                                   log_flush_interval, log_flush_rows, log_max_bytes, log_max_age)
+
+    # One worker thread per instrument - both queries released together by the barrier each cycle
+    executor = ThreadPoolExecutor(max_workers=2)
+    query_barrier = threading.Barrier(2)
+    skew_total = 0.0
+    skew_max = 0.0
 
     try:
         print("Measurements being taken...")
         print("Press any key to abort.")
         cycle_count = 0                                             # Current measurement number
+        scheduler = DeadlineScheduler(sample_period)                # Readings paced on absolute deadlines
+        run_start = time.perf_counter()                             # Reference for per-reading times
         # Collect readings
         while cycle_count < num_samples:
+            scheduler.wait()
             start_time = time.time()
 
-            # Query current reading from DMM1
-            current = float(dmm_c.query(":MEAS:CURR:DC?"))
-            # Query voltage reading from DMM2
-            voltage = float(dmm_v.query("READ?"))
+            # Query current reading from DMM1 and voltage reading from DMM2 concurrently
+            current_future = executor.submit(timed_query, dmm_c, ":MEAS:CURR:DC?", query_barrier)
+            voltage_future = executor.submit(timed_query, dmm_v, "READ?", query_barrier)
+            current, current_time = current_future.result()
+            voltage, voltage_time = voltage_future.result()
+
+            skew = voltage_time - current_time
+            skew_total += abs(skew)
+            skew_max = max(skew_max, abs(skew))
 
-            # Log timestamp and current to CSV file with milliseconds
+            # Log timestamp, readings, reading times and skew to CSV file
             timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))
-            csv_writer.writerow([timestamp, current, voltage])
-            csv_file.flush()  # Flush buffer to ensure data is written immediately
+            csv_logger.writerow([timestamp, current, voltage, current_time - run_start, voltage_time - run_start, skew * 1e3])
 
-            # Wait for next reading
-            time.sleep(sample_period)  # user specified collection rate
             cycle_count = cycle_count + 1
 
     except KeyboardInterrupt:
@@ -109,9 +279,14 @@ def main():
     finally:
         print("\n\n")
         print("Measurements Complete!")
-        print("Results stored in 'CV_Log.csv'")
+        print(scheduler.summary())
+        if cycle_count:
+            print(f"V-I skew: mean {skew_total / cycle_count * 1e3:.3f} ms, max {skew_max * 1e3:.3f} ms")
         # Close CSV file and instrument connection
-        csv_file.close()
+        query_barrier.abort()                                       # Release a worker left waiting if the loop was interrupted
+        executor.shutdown()
+        csv_logger.close()
+        print(f"Results stored in {', '.join(csv_logger.filenames)}")
         dmm_c.close()
         dmm_v.close()
         rm.close()
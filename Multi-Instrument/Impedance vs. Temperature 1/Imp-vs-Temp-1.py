@@ -5,12 +5,59 @@
 #
 #   - Author: Stuart Thomas
 #   - Date: 15/01/2025
-#   - Version: 1.0
+#   - Version: 1.8
+#    - Changelog: 1.0 -> 1.1
+#          - Frequency sweep uses the LCR meter's list sweep (default) - frequencies loaded once, all 7 points measured with a single trigger
+#            and returned in one reply (2 bus transactions per sweep rather than 21) - change 'list_sweep' variable for point-by-point sweep
+#    - Changelog: 1.1 -> 1.2
+#          - Binary REAL data format added (default) - LCR replies decoded straight into numpy arrays by decodeMeasurement()
+#            (8 bytes per value rather than ~13 ASCII characters + separator) - change 'data_format' variable for ASCII
+#          - Measurement status separated from the Cp-Rp values, and any non-zero status (bridge unbalanced, signal source overload...) is reported
+#    - Changelog: 1.2 -> 1.3
+#          - Sweep driven by the 'frequencies' list - freqSweep() returns an (n_freq x 2) [Cp, Rp] array, tD and permittivity calculated
+#            for all frequencies at once with numpy, .csv header generated from the list (any number of points, e.g. 50+ point log sweeps)
+#          - impSpec/floatValues classes and splitString() removed
+#    - Changelog: 1.3 -> 1.4
+#          - Temperature sampled at a fixed rate by TempTracker ('temp_sample_rate') rather than in a tight unthrottled loop
+#          - Oven ramp rate fitted over the last 'ramp_fit_window' seconds - next degree crossing predicted, LCR sweep armed in advance
+#            and the temperature sampled at the predicted crossing, so the sweep fires at the threshold
+#          - If the oven outruns the sweep, skipped degree buckets are recorded in '<results>_missed.csv' and the sweep catches up
+#            to the current degree (previously the test stalled until the temperature was brought back down)
+#          - Test ends at 'end_temperature'
+#    - Changelog: 1.4 -> 1.5
+#          - Temperature sampled in a background thread (SweepTempSampler) while each sweep runs ('sweep_temp_sample_rate')
+#          - Each frequency point gets its own measurement time and interpolated temperature in the .csv
+#                - Point-by-point sweep: measured time of each point. List sweep: points spread evenly between trigger and reply (estimate)
+#          - Sweep start/end temperature and drift during the sweep stored with each row
+#                - End of sweep covered by the next regular temperature sample, so stopping the sampler adds no DMM query to each degree step
+#    - Changelog: 1.5 -> 1.6
+#          - Measurement time auto-tune mode added ('tune_mode') - run with the oven OFF:
+#                - Each frequency is measured 'tune_repeats' times at each aperture/averaging setting in 'tune_settings'
+#                - Fastest setting with Cp and Rp repeatability (relative std) within 'tune_precision' chosen per frequency
+#                - Saved to 'aperture_profile.json' (next to the results file) and used by freqSweep() on the following test runs
+#          - Profile with one setting for all frequencies applied once (list sweep still used), otherwise sweep is point-by-point (':APER' per point)
+#    - Changelog: 1.6 -> 1.7
+#          - Results stored in an append-only SQLite database ('results.db', next to the results file) in long format - one row per
+#            frequency point (timestamp, temperature, frequency, Cp, Rp, tD, permittivity) - every test run is kept, tagged with a run id
+#          - Rows committed in batches ('db_commit_sweeps' sweeps or 'db_commit_interval' seconds) rather than flushing the .csv every row
+#          - Index on (frequency, temperature) - e.g. Cp at 1kHz between 200 and 300 Degrees C across all runs:
+#                SELECT run_id, temperature, cp FROM measurements WHERE frequency = 1000 AND temperature BETWEEN 200 AND 300
+#          - Results .csv (original wide layout, one row per degree) exported from the database at the end of the test (or if interrupted)
+#          - Results folder falls back to the script folder if 'results_dir' does not exist on this machine
+#    - Changelog: 1.7 -> 1.8
+#          - Test progress checkpointed to 'checkpoint.json' (next to the results file) each time results are committed, and when the
+#            test stops (end temperature, crash, VISA error or Ctrl+C) - run id, last completed degree, sweep configuration, sample
+#            dimensions and number of sweeps stored. Written to a temporary file then renamed, so a checkpoint is never left half written
+#          - Resume mode added ('resume_mode') - instruments reconnected, setup prompts skipped, sweep configuration and sample dimensions
+#            restored from the checkpoint, and the same run continued in the results database from the next degree
+#                - Aperture settings and sweep mode (list/point-by-point) also restored - 'aperture_profile.json' is not reloaded on resume
+#                - Sweeps stored after the checkpoint (uncommitted when the test stopped) are discarded, degrees the oven passed while the
+#                  test was down are logged to '<results>_missed.csv' (appended to, not overwritten)
 #   - Description: - Program monitors thermocouple temperature (using DMM in temp mode). 
 #                  - A lab oven with controllable temperature profile was used to ramp up temperature.
 #                  - For every increase in temperature from 30 Degrees Centigrade to 600 Degrees Centigrade, the LCR meter takes a swept impedance measurement (Cp-Rp)
-#                    across the following frequencies: 20Hz, 100Hz, 1kHz, 10kHz, 100kHz, 1MHZ, 2MHz.
-#                  - Each sweep measurement and the corresponding temperature is output to a .csv file.
+#                    across the frequencies in 'frequencies' (default: 20Hz, 100Hz, 1kHz, 10kHz, 100kHz, 1MHZ, 2MHz).
+#                  - Each sweep measurement and the corresponding temperature is stored in a results database, and exported to a .csv file.
 
 #                   Default instrument 1: Keysight E4980A LCR Meter
 #                   Default instrument 2: Keithley DMM6500 DMM
@@ -25,282 +72,517 @@
 
 import pyvisa
 import csv
+import json
+import os
+import sqlite3
+import threading
 import time
-import math
+from collections import deque
+import numpy as np
+
+# Sweep frequencies (Hz) - any number of points (list sweep table holds up to 201), .csv columns generated from this list
+# e.g. 51 point log sweep:  frequencies = np.round(np.logspace(np.log10(20), np.log10(2e6), 51)).tolist()
+frequencies = [20, 100, 1000, 10000, 100000, 1000000, 2000000]
+
+# True = list sweep (one trigger measures every frequency), False = one ':FREQ:CW', ':INIT', '*TRG' per frequency
+list_sweep = True
+
+# LCR measurement data format - "REAL" (64-bit binary, default) or "ASCII"
+data_format = "REAL"
+
+# Temperature range (Deg C) - a sweep is taken at each whole degree from start to end
+start_temperature = 30
+end_temperature = 600
+
+# Temperature sample rate (Hz), and time window (s) the oven ramp rate is fitted over
+temp_sample_rate = 2
+ramp_fit_window = 30
+
+# Temperature sample rate (Hz) in the background while each sweep runs
+sweep_temp_sample_rate = 10
+
+# Measurement time auto-tune - True = tune aperture/averaging per frequency and save profile (oven OFF), False = normal test run
+tune_mode = False
+
+# Required Cp and Rp repeatability (relative standard deviation) and number of repeat measurements per setting when tuning
+tune_precision = 0.001
+tune_repeats = 10
+
+# Aperture (SHORt/MEDium/LONG) and averaging settings tried when tuning
+tune_settings = [("SHOR", 1), ("SHOR", 4), ("MED", 1), ("MED", 4), ("LONG", 1), ("LONG", 4)]
+
+# Aperture/averaging used for any frequency missing from the tuned profile (instrument default after '*RST')
+default_aperture = "MED,1"
+
+# Resume mode - True = continue the last (interrupted) test run from its checkpoint, False = new test run
+resume_mode = False
+
+# Results folder - results .csv, results database, missed degrees .csv and aperture profile are kept here
+results_dir = "/home/napierats/Documents/Automated Test System/SCPI Programs/Imp-vs-temp"
+
+# Results database commits - every 'db_commit_sweeps' sweeps or 'db_commit_interval' seconds, whichever comes first
+db_commit_sweeps = 10
+db_commit_interval = 30
+
+# LCR measurement status codes (see manual - ':FETCh?')
+MEASUREMENT_STATUS = {-1: "No data", 0: "Normal", 1: "Analog bridge unbalanced", 2: "A/D converter not working", 3: "Signal source overloaded", 4: "ALC unable to regulate"}
+
+
+def frequencyLabel(frequency):
+    # e.g. 20 -> "20Hz", 1000 -> "1kHz", 2000000 -> "2MHz"
+    for scale, unit in ((1e6, "MHz"), (1e3, "kHz")):
+        if frequency >= scale:
+            return f"{frequency / scale:g}{unit}"
+    return f"{frequency:g}Hz"
+
+
+def csvHeader(sweepFrequencies):
+    # Time, temperature, sweep temperature drift, then C, R, tD, permittivity, point temperature and point time (from sweep start) for each sweep frequency
+    header = ["Time", "Temperature (Deg C)", "Sweep Start Temp (Deg C)", "Sweep End Temp (Deg C)", "Sweep Drift (Deg C)"]
+    for frequency in sweepFrequencies:
+        label = frequencyLabel(frequency)
+        header += ["C_" + label + " (F)", "R_" + label + " (Ohms)", "tD_" + label, "Perm_" + label + " (F/m)",
+                   "Temp_" + label + " (Deg C)", "Time_" + label + " (s)"]
+    return header
+
+
+def loadCheckpoint():
+    # Returns the saved test progress - raises if there is nothing to resume
+    if not os.path.exists(checkpointPath):
+        raise FileNotFoundError("No checkpoint found at " + checkpointPath + " - set 'resume_mode' to False to start a new test run")
+    with open(checkpointPath, "r") as file:
+        checkpoint = json.load(file)
+    if checkpoint["complete"]:
+        raise RuntimeError("Run " + str(checkpoint["run_id"]) + " already completed - set 'resume_mode' to False to start a new test run")
+    return checkpoint
+
+
+def writeCheckpoint(run_id, last_bucket, sweeps, complete=False):
+    # Saves test progress - written to a temporary file then renamed over the old checkpoint, so a crash mid-write leaves the previous one intact
+    checkpoint = {"run_id": run_id, "last_bucket": last_bucket, "sweeps": sweeps, "complete": complete,
+                  "time": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()), "area": A, "separation": d,
+                  "frequencies": list(frequencies), "list_sweep": list_sweep, "data_format": data_format,
+                  "start_temperature": start_temperature, "end_temperature": end_temperature,
+                  "aperture_settings": {str(frequency): setting for frequency, setting in aperture_settings.items()}}
+    tempPath = checkpointPath + ".tmp"
+    with open(tempPath, "w") as file:
+        json.dump(checkpoint, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tempPath, checkpointPath)
+
 
 # Connect to the Keysight E4980 LCR Meter
 rm = pyvisa.ResourceManager()
 print("Pyvisa resource opened...")
 lcr = rm.open_resource('TCPIP0::10.0.0.11::INSTR')    # Open LCR Meter
+lcr.timeout = 10000                                             # List sweep returns all points in one reply - allow for the 20Hz point
 print("Connected to LCR meter...")
 dmm = rm.open_resource('TCPIP0::10.0.0.10::INSTR')         # Open DMM
 print("Connected to DMM...")
 
-# Create CSV file for logging
-filePath = "/home/napierats/Documents/Automated Test System/SCPI Programs/Imp-vs-temp/results.csv"
-
-csv_file = open(filePath, "w", newline='')
-csv_writer = csv.writer(csv_file)
-csv_writer.writerow(["Impedance vs. Temperature - impedance specified as Cp(F)-Rp(R) "])
-csv_writer.writerow(["Time","Temperature (Deg C)","C_20Hz (F)","R_20Hz (Ohms)","tD_20Hz","Perm_20Hz (F/m)","C_100Hz (F)","R_100Hz (Ohms)","tD_100Hz","Perm_100Hz (F/m)","C_1kHz (F)","R_1kHz (Ohms)","tD_1kHz","Perm_1kHz (F/m)","C_10kHz (F)","R_10kHz (Ohms)","tD_10kHz","Perm_10kHz (F/m)","C_100kHz (F)","R_100kHz (Ohms)","tD_100kHz","Perm_100kHz (F/m)","C_1MHz (F)","R_1MHz (Ohms)","tD_1MHz","Perm_1MHz (F/m)","C_2MHz (F)","R_2MHz (Ohms)","tD_2MHz","Perm_2MHz (F/m)"])
+# Results files
+if not os.path.isdir(results_dir):
+    results_dir = os.path.dirname(os.path.abspath(__file__))
+filePath = os.path.join(results_dir, "results.csv")
+
+# Results database (all runs) - results .csv exported from here at the end of the test
+dbPath = os.path.join(results_dir, "results.db")
+
+# Test progress checkpoint - resume mode carries on from here
+checkpointPath = os.path.join(results_dir, "checkpoint.json")
+checkpoint = None
+if resume_mode and not tune_mode:
+    checkpoint = loadCheckpoint()
+    # Sweep configuration restored so the resumed sweeps match the rest of the run
+    frequencies = checkpoint["frequencies"]
+    list_sweep = checkpoint["list_sweep"]
+    data_format = checkpoint["data_format"]
+    end_temperature = checkpoint["end_temperature"]
+    print("Resuming run", checkpoint["run_id"], "from", checkpoint["last_bucket"] + 1, "Degrees Centigrade (checkpoint saved", checkpoint["time"] + ")")
+
+# Per-frequency aperture/averaging profile written by tune mode
+profilePath = os.path.join(os.path.dirname(filePath), "aperture_profile.json")
+
+# Per-frequency aperture setting used by freqSweep() - {frequency: "MED,1"} (empty = instrument default)
+aperture_settings = {}
+if checkpoint:
+    # Resumed run keeps the apertures it started with - the saved profile may have been re-tuned since
+    aperture_settings = {frequency: checkpoint["aperture_settings"][str(frequency)] for frequency in frequencies
+                         if str(frequency) in checkpoint["aperture_settings"]}
+
+# Degree buckets missed because the oven outran the sweep are logged separately
+missedPath = filePath.rsplit(".", 1)[0] + "_missed.csv"
+missed_csv_file = open(missedPath, "a" if checkpoint else "w", newline='')   # Resumed run appends to the missed degrees log
+missed_csv_writer = csv.writer(missed_csv_file)
+if checkpoint is None:
+    missed_csv_writer.writerow(["Time", "Missed Temperature (Deg C)", "Temperature When Detected (Deg C)", "Ramp Rate (Deg C/min)"])
 print("Log file created...\n")
 
-# Ask user to set up sample
-print("Test Setup:\n")
-print("1). Place sample in fixture inside oven and close lid                                (press any key when complete)\n")
-input()
-print("2). Confirm that thermocouple is correctly connected to wires at oven and to DMM     (press any key when complete)\n")
-input()
-print("3). Prepare oven heating profile - do not yet activate heating                       (press any key when complete)\n")
-input()
+if checkpoint is None:
+    # Ask user to set up sample
+    print("Test Setup:\n")
+    print("1). Place sample in fixture inside oven and close lid                                (press any key when complete)\n")
+    input()
+    print("2). Confirm that thermocouple is correctly connected to wires at oven and to DMM     (press any key when complete)\n")
+    input()
+    print("3). Prepare oven heating profile - do not yet activate heating                       (press any key when complete)\n")
+    input()
 
-# Ask user to input physical characteristics of capacitor/capacitive device
-A = float(input("4). Enter the area of the capacitor (in square meters): "))
-d = float(input("5). Enter the separation distance of the capacitor plates (in meters): "))
+    # Ask user to input physical characteristics of capacitor/capacitive device
+    A = float(input("4). Enter the area of the capacitor (in square meters): "))
+    d = float(input("5). Enter the separation distance of the capacitor plates (in meters): "))
+else:
+    # Sample already set up - dimensions from the checkpoint
+    A = checkpoint["area"]
+    d = checkpoint["separation"]
+    print("Capacitor area:", A, "square meters    Plate separation:", d, "meters\n")
 
 # Ask user to activate profile
-print("6). Activate oven heating and PRESS ANY KEY IN THIS CONSOLE WITHIN 5 SECONDS\n")
+if checkpoint:
+    print("6). Resuming test - confirm oven heating profile is still running                  (press any key to resume)\n")
+elif tune_mode:
+    print("6). Measurement time auto-tune - ensure oven heating is OFF                        (press any key to begin tuning)\n")
+else:
+    print("6). Activate oven heating and PRESS ANY KEY IN THIS CONSOLE WITHIN 5 SECONDS\n")
 input()
 
 
-def freqSweep():            
-
-    class impSpec:
-        def __init__(imp_20Hz, imp_100Hz, imp_1kHz, imp_10kHz, imp_100kHz, imp_1MHz, imp_2MHz):
-            impSpec.imp_20Hz = 0
-            impSpec.imp_100Hz = 0
-            impSpec.imp_1kHz = 0
-            impSpec.imp_10kHz = 0
-            impSpec.imp_100kHz = 0
-            impSpec.imp_1MHz = 0
-            impSpec.imp_2MHz = 0
-
-
-    # Set initial frequency - 20Hz Reading
-    lcr.write(":FREQ:CW 20")
-    lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-    impSpec.imp_20Hz = lcr.query("*TRG")					# Take impedance measurement
-    print("Impedance:", impSpec.imp_20Hz, "\n")
-
-    # 100Hz Reading
-    lcr.write(":FREQ:CW 100")
-    lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-    impSpec.imp_100Hz = lcr.query("*TRG")					# Take impedance measurement
-    print("Impedance:", impSpec.imp_100Hz, "\n")
-
-    # 1kHz Reading
-    lcr.write(":FREQ:CW 1000")
-    lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-    impSpec.imp_1kHz = lcr.query("*TRG")					# Take impedance measurement
-    print("Impedance:", impSpec.imp_1kHz, "\n")
-
-    # 10kHz Reading
-    lcr.write(":FREQ:CW 10000")
-    lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-    impSpec.imp_10kHz = lcr.query("*TRG")					# Take impedance measurement
-    print("Impedance:", impSpec.imp_10kHz, "\n")
-
-    # 100kHz Reading
-    lcr.write(":FREQ:CW 100000")
-    lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-    impSpec.imp_100kHz = lcr.query("*TRG")					# Take impedance measurement
-    print("Impedance:", impSpec.imp_100kHz, "\n")
-
-    # 1MHz Reading
-    lcr.write(":FREQ:CW 1000000")
-    lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-    impSpec.imp_1MHz = lcr.query("*TRG")					# Take impedance measurement
-    print("Impedance:", impSpec.imp_1MHz, "\n")
-
-    # 2MHz Reading
-    lcr.write(":FREQ:CW 2000000")
-    lcr.write(":INIT")					# Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
-    impSpec.imp_2MHz = lcr.query("*TRG")					# Take impedance measurement
-    print("Impedance:", impSpec.imp_2MHz, "\n")
-
-    return impSpec
-
-def splitString(impSpec):
-    class floatValues:
-        def __init__(float1_20Hz, float2_20Hz, float1_100Hz, float2_100Hz, float1_1kHz, float2_1kHz, float1_10kHz, float2_10kHz, float1_100kHz, float2_100kHz, float1_1MHz, float2_1MHz, float1_2MHz, float2_2MHz):
-            floatValues.float1_20Hz = 0
-            floatValues.float2_20Hz = 0
-            floatValues.float1_100Hz = 0
-            floatValues.float2_100Hz = 0
-            floatValues.float1_1kHz = 0
-            floatValues.float2_1kHz = 0
-            floatValues.float1_10kHz = 0
-            floatValues.float2_10kHz = 0
-            floatValues.float1_100kHz = 0
-            floatValues.float2_100kHz = 0
-            floatValues.float1_1MHz = 0
-            floatValues.float2_1MHz = 0
-            floatValues.float1_2MHz = 0
-            floatValues.float2_2MHz = 0
-
-    # Split 20Hz string-----#
-    parts_20Hz = impSpec.imp_20Hz.split(',')               # Split string by commas
-    part1_20Hz = parts_20Hz[0]
-    part2_20Hz = parts_20Hz[1]                             # Extract parts into seperate variables
-    floatValues.float1_20Hz = float(part1_20Hz)
-    floatValues.float2_20Hz = float(part2_20Hz)                        # Convert to floats
-    #-----------------------#
-
-    # Split 100Hz string----#
-    parts_100Hz = impSpec.imp_100Hz.split(',')               
-    part1_100Hz = parts_100Hz[0]
-    part2_100Hz = parts_100Hz[1]                             
-    floatValues.float1_100Hz = float(part1_100Hz)
-    floatValues.float2_100Hz = float(part2_100Hz)                        
-    #-----------------------#
-
-    # Split 1kHz string-----#
-    parts_1kHz = impSpec.imp_1kHz.split(',')               
-    part1_1kHz = parts_1kHz[0]
-    part2_1kHz = parts_1kHz[1]                             
-    floatValues.float1_1kHz = float(part1_1kHz)
-    floatValues.float2_1kHz = float(part2_1kHz)                        
-    #-----------------------#
-
-    # Split 10kHz string-----#
-    parts_10kHz = impSpec.imp_10kHz.split(',')               
-    part1_10kHz = parts_10kHz[0]
-    part2_10kHz = parts_10kHz[1]                             
-    floatValues.float1_10kHz = float(part1_10kHz)
-    floatValues.float2_10kHz = float(part2_10kHz)                        
-    #-----------------------#
-
-    # Split 100kHz string-----#
-    parts_100kHz = impSpec.imp_100kHz.split(',')               
-    part1_100kHz = parts_100kHz[0]
-    part2_100kHz = parts_100kHz[1]                             
-    floatValues.float1_100kHz = float(part1_100kHz)
-    floatValues.float2_100kHz = float(part2_100kHz)                        
-    #-----------------------#
-
-    # Split 1MHz string-----#
-    parts_1MHz = impSpec.imp_1MHz.split(',')               
-    part1_1MHz = parts_1MHz[0]
-    part2_1MHz = parts_1MHz[1]                             
-    floatValues.float1_1MHz = float(part1_1MHz)
-    floatValues.float2_1MHz = float(part2_1MHz)                        
-    #-----------------------#
-
-    # Split 2MHz string-----#
-    parts_2MHz = impSpec.imp_2MHz.split(',')               
-    part1_2MHz = parts_2MHz[0]
-    part2_2MHz = parts_2MHz[1]                             
-    floatValues.float1_2MHz = float(part1_2MHz)
-    floatValues.float2_2MHz = float(part2_2MHz)                        
-    #-----------------------#
-
-    return floatValues
-
-# Calculate loss Tangent for all Impedances
-def calcLossTangent(floatValues):
-    
-    tan_deltas = [0,0,0,0,0,0,0,0] 
-
-    # Calculate tD for 20Hz--#
-    currentC = floatValues.float1_20Hz
-    currentR = floatValues.float2_20Hz
-    currentOmega = 2 * math.pi * 20
-    tan_deltas[1] = currentOmega * currentR * currentC
-    #------------------------#
-
-    # Calculate tD for 100Hz--#
-    currentC = floatValues.float1_100Hz
-    currentR = floatValues.float2_100Hz
-    currentOmega = 2 * math.pi * 100
-    tan_deltas[2] = currentOmega * currentR * currentC
-    #------------------------#
-
-    # Calculate tD for 1kHz--#
-    currentC = floatValues.float1_1kHz
-    currentR = floatValues.float2_1kHz
-    currentOmega = 2 * math.pi * 1000
-    tan_deltas[3] = currentOmega * currentR * currentC
-    #------------------------#
-
-    # Calculate tD for 10kHz--#
-    currentC = floatValues.float1_10kHz
-    currentR = floatValues.float2_10kHz
-    currentOmega = 2 * math.pi * 10000
-    tan_deltas[4] = currentOmega * currentR * currentC
-    #------------------------#
-
-    # Calculate tD for 100kHz--#
-    currentC = floatValues.float1_100kHz
-    currentR = floatValues.float2_100kHz
-    currentOmega = 2 * math.pi * 100000
-    tan_deltas[5] = currentOmega * currentR * currentC
-    #------------------------#
-
-    # Calculate tD for 1MHz--#
-    currentC = floatValues.float1_1MHz
-    currentR = floatValues.float2_1MHz
-    currentOmega = 2 * math.pi * 1000000
-    tan_deltas[6] = currentOmega * currentR * currentC
-    #------------------------#
-
-    # Calculate tD for 2MHz--#
-    currentC = floatValues.float1_2MHz
-    currentR = floatValues.float2_2MHz
-    currentOmega = 2 * math.pi * 2000000
-    tan_deltas[7] = currentOmega * currentR * currentC
-    #------------------------#
-
-    return tan_deltas
-
-# Calculate Permittivity for all Impedances
-def calcPermittivity(floatValues):
-
-    epsilon_O = 8.854e-12                           # F/m
-    permittivity = [0,0,0,0,0,0,0,0]
-
-    # Calculate perm for 20Hz--#
-    currentC = floatValues.float1_20Hz  
-    currentEpsilonR = currentC * d / (A * epsilon_O)
-    permittivity[1] = currentEpsilonR * epsilon_O
-    #--------------------------#
-
-    # Calculate perm for 100Hz--#
-    currentC = floatValues.float1_100Hz  
-    currentEpsilonR = currentC * d / (A * epsilon_O)
-    permittivity[2] = currentEpsilonR * epsilon_O
-    #--------------------------#    
-
-    # Calculate perm for 1kHz--#
-    currentC = floatValues.float1_1kHz  
-    currentEpsilonR = currentC * d / (A * epsilon_O)
-    permittivity[3] = currentEpsilonR * epsilon_O
-    #--------------------------#
-
-    # Calculate perm for 10kHz--#
-    currentC = floatValues.float1_10kHz  
-    currentEpsilonR = currentC * d / (A * epsilon_O)
-    permittivity[4] = currentEpsilonR * epsilon_O
-    #--------------------------#
-
-    # Calculate perm for 100kHz--#
-    currentC = floatValues.float1_100kHz  
-    currentEpsilonR = currentC * d / (A * epsilon_O)
-    permittivity[5] = currentEpsilonR * epsilon_O
-    #--------------------------#
-
-    # Calculate perm for 1MHz--#
-    currentC = floatValues.float1_1MHz  
-    currentEpsilonR = currentC * d / (A * epsilon_O)
-    permittivity[6] = currentEpsilonR * epsilon_O
-    #--------------------------#
-
-    # Calculate perm for 2MHz--#
-    currentC = floatValues.float1_2MHz  
-    currentEpsilonR = currentC * d / (A * epsilon_O)
-    permittivity[7] = currentEpsilonR * epsilon_O
-    #--------------------------#
-
-    return permittivity
+class TempTracker:
+    # Samples the thermocouple at a fixed rate and fits the oven ramp rate (Deg C/s) over the last 'fit_window' seconds of readings
+
+    def __init__(self, sample_rate, fit_window):
+        self.period = 1 / sample_rate
+        self.min_interval = self.period / 4                                 # Shortest gap between samples (early sample at a predicted crossing)
+        self.fit_window = fit_window
+        self.times = deque()
+        self.temperatures = deque()
+        self.next_sample = time.monotonic()
+
+    def sample(self, wake_time=None):
+        # Waits until the next sample time (or 'wake_time', if sooner) then reads the temperature - returns (time, temperature)
+        # A 'wake_time' already passed (oven lagging the prediction) is ignored, and samples are never closer together than 'min_interval'
+        target = self.next_sample
+        if wake_time is not None and wake_time > time.monotonic():
+            target = min(target, wake_time)
+        if self.times:
+            target = max(target, self.times[-1] + self.min_interval)
+        delay = target - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        temperature = tempReadingConvert(dmm.query(":MEAS:TEMP?"))
+        now = time.monotonic()
+
+        # Next regular sample - sample slots missed during a sweep are skipped rather than taken back to back
+        while self.next_sample <= now:
+            self.next_sample += self.period
+
+        self.times.append(now)
+        self.temperatures.append(temperature)
+        while now - self.times[0] > self.fit_window:
+            self.times.popleft()
+            self.temperatures.popleft()
+        return now, temperature
+
+    def rampRate(self):
+        # Least-squares slope of the readings in the fit window (Deg C/s)
+        if len(self.times) < 3:
+            return 0.0
+        times = np.array(self.times) - self.times[0]
+        return np.polyfit(times, np.array(self.temperatures), 1)[0]
+
+    def predictCrossing(self, target):
+        # Predicted time (time.monotonic) the temperature reaches 'target', or None if it is not rising
+        rate = self.rampRate()
+        if rate <= 0:
+            return None
+        times = np.array(self.times) - self.times[0]
+        slope, intercept = np.polyfit(times, np.array(self.temperatures), 1)
+        fitted_now = intercept + slope * times[-1]
+        return self.times[-1] + max(0.0, (target - fitted_now) / rate)
+
+
+class SweepTempSampler:
+    # Samples the thermocouple in a background thread while a sweep runs - stopping only waits for a reading already in progress,
+    # the sweep end is covered by the next TempTracker sample (see finishSweep())
+
+    def __init__(self, sample_rate):
+        self.period = 1 / sample_rate
+
+    def start(self):
+        self.times = []
+        self.temperatures = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            query_time = time.monotonic()
+            temperature = tempReadingConvert(dmm.query(":MEAS:TEMP?"))
+            self.times.append((query_time + time.monotonic()) / 2)
+            self.temperatures.append(temperature)
+            self.stop_event.wait(self.period)
+
+    def stop(self):
+        # Returns (times, temperatures) arrays of the readings taken
+        self.stop_event.set()
+        self.thread.join()
+        return np.array(self.times), np.array(self.temperatures)
+
+
+class ResultsStore:
+    # Append-only SQLite results store - one row per sweep in 'sweeps', one row per frequency point in 'measurements' (long format).
+    # Rows are committed in batches, and WAL mode lets the database be queried by another program while a test is running
+
+    def __init__(self, path, commit_sweeps, commit_interval):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, start_time TEXT, area REAL, separation REAL, frequencies TEXT);
+            CREATE TABLE IF NOT EXISTS sweeps (run_id INTEGER, sweep INTEGER, timestamp TEXT, temperature REAL, start_temperature REAL,
+                                               end_temperature REAL, drift REAL, PRIMARY KEY (run_id, sweep));
+            CREATE TABLE IF NOT EXISTS measurements (run_id INTEGER, sweep INTEGER, point INTEGER, timestamp TEXT, temperature REAL, frequency REAL,
+                                                     cp REAL, rp REAL, tan_delta REAL, permittivity REAL, point_time REAL);
+            CREATE INDEX IF NOT EXISTS measurements_frequency_temperature ON measurements (frequency, temperature);
+        """)
+        self.connection.commit()
+        self.commit_sweeps = commit_sweeps
+        self.commit_interval = commit_interval
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def resumeRun(self, run_id, sweeps):
+        # Continues an existing run after its first 'sweeps' sweeps - any later (uncheckpointed) sweeps are discarded
+        self.connection.execute("DELETE FROM sweeps WHERE run_id = ? AND sweep >= ?", (run_id, sweeps))
+        self.connection.execute("DELETE FROM measurements WHERE run_id = ? AND sweep >= ?", (run_id, sweeps))
+        self.connection.commit()
+        self.run_id = run_id
+        self.sweep = sweeps
+        return self.run_id
+
+    def startRun(self, area, separation, sweepFrequencies):
+        # Records a new test run - returns its run id
+        cursor = self.connection.execute("INSERT INTO runs (start_time, area, separation, frequencies) VALUES (?, ?, ?, ?)",
+                                         (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()), area, separation, json.dumps(list(sweepFrequencies))))
+        self.connection.commit()
+        self.run_id = cursor.lastrowid
+        self.sweep = 0
+        return self.run_id
+
+    def addSweep(self, timestamp, temperature, start_temperature, end_temperature, sweepFrequencies, impValues, tan_deltas, permittivity, point_temps, point_times):
+        # Adds one sweep (one row per frequency point) - committed once 'commit_sweeps' sweeps are pending or 'commit_interval' has passed
+        self.connection.execute("INSERT INTO sweeps VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (self.run_id, self.sweep, timestamp, temperature, start_temperature, end_temperature, end_temperature - start_temperature))
+        self.connection.executemany("INSERT INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    [(self.run_id, self.sweep, point, timestamp) + row for point, row in
+                                     enumerate(zip(point_temps.tolist(), list(sweepFrequencies), impValues[:, 0].tolist(), impValues[:, 1].tolist(),
+                                                   tan_deltas.tolist(), permittivity.tolist(), point_times.tolist()))])
+        self.sweep += 1
+        self.pending += 1
+        if self.pending >= self.commit_sweeps or time.monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def exportWideCsv(self, run_id, path):
+        # Writes a run to 'path' in the original .csv layout - one row per sweep, 6 columns per frequency
+        (frequency_list,) = self.connection.execute("SELECT frequencies FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        sweepFrequencies = json.loads(frequency_list)
+        sweeps = self.connection.execute("SELECT timestamp, temperature, start_temperature, end_temperature, drift FROM sweeps "
+                                         "WHERE run_id = ? ORDER BY sweep", (run_id,)).fetchall()
+        points = self.connection.execute("SELECT cp, rp, tan_delta, permittivity, temperature, point_time FROM measurements "
+                                         "WHERE run_id = ? ORDER BY sweep, point", (run_id,)).fetchall()
+        points = np.array(points, dtype=float).reshape(len(sweeps), len(sweepFrequencies) * 6)
+
+        with open(path, "w", newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Impedance vs. Temperature - impedance specified as Cp(F)-Rp(R) "])
+            writer.writerow(csvHeader(sweepFrequencies))
+            writer.writerows(list(sweep) + row for sweep, row in zip(sweeps, points.tolist()))
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+def finishSweep(store, sweep, end_time=None, end_temperature=None):
+    # Stores a sweep once a temperature reading after its end is available ('end_temperature' at 'end_time', the next TempTracker sample) -
+    # point temperatures and sweep start/end temperature interpolated from the readings taken during the sweep plus this one
+    # (no readings at all - DMM not responding - the temperature that triggered the sweep is used throughout)
+    temp_times, temps = sweep["temp_times"], sweep["temps"]
+    if end_time is not None:
+        temp_times = np.append(temp_times, end_time)
+        temps = np.append(temps, end_temperature)
+    if len(temp_times) == 0:
+        temp_times, temps = np.array([sweep["start"]]), np.array([sweep["temperature"]])
+    point_temps = np.interp(sweep["point_times"], temp_times, temps)
+    sweep_start_temp, sweep_end_temp = np.interp([sweep["start"], sweep["end"]], temp_times, temps)
+    print("Sweep drift:", round(sweep_end_temp - sweep_start_temp, 3), "Degrees Centigrade over", round(sweep["end"] - sweep["start"], 2), "s")
+
+    impValues = sweep["values"]
+    store.addSweep(sweep["timestamp"], sweep["temperature"], sweep_start_temp, sweep_end_temp, frequencies, impValues,
+                   calcLossTangent(impValues), calcPermittivity(impValues), point_temps, sweep["point_times"] - sweep["start"])
+
+
+def armSweep():
+    # Puts the LCR meter into WAIT FOR TRIGGER state ahead of a list sweep, so the sweep starts as soon as it is triggered
+    lcr.write(":INIT")
+
+
+def freqSweep(armed=False):
+    # Measures every frequency in 'frequencies' - returns (n_freq, 2) array, one [Cp, Rp] row per frequency,
+    # and the measurement time (time.monotonic) of each point
+    if list_sweep:
+        # One trigger measures every frequency
+        if not armed:
+            armSweep()                                      # Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
+        trigger_time = time.monotonic()
+        values, status = readMeasurement(len(frequencies))
+        reply_time = time.monotonic()
+        checkStatus(frequencies, status)
+        # Points are measured in turn between trigger and reply - spread evenly (estimate)
+        point_times = trigger_time + (np.arange(len(frequencies)) + 0.5) / len(frequencies) * (reply_time - trigger_time)
+    else:
+        values = np.empty((len(frequencies), 2))
+        point_times = np.empty(len(frequencies))
+        for index, frequency in enumerate(frequencies):
+            lcr.write(":FREQ:CW " + str(frequency))
+            if aperture_settings:
+                lcr.write(":APER " + aperture_settings.get(frequency, default_aperture))   # Tuned measurement time for this frequency
+            lcr.write(":INIT")                              # Re-initialise instrument to WAIT FOR TRIGGER state (see manual - page 247)
+            trigger_time = time.monotonic()
+            values[index] = readPoint(frequency)            # Take impedance measurement
+            point_times[index] = (trigger_time + time.monotonic()) / 2
+
+    print("Impedance (Cp, Rp):", values.tolist(), "\n")
+    return values, point_times
+
+
+# Calculate loss Tangent for all Impedances - tD = 2*pi*f * R * C
+def calcLossTangent(values):
+    return 2 * np.pi * np.asarray(frequencies) * values[:, 1] * values[:, 0]
+
+
+# Calculate Permittivity for all Impedances - perm = epsilon_r * epsilon_0 = C * d / A  (F/m)
+def calcPermittivity(values):
+    return values[:, 0] * d / A
+
+
+def decodeMeasurement(reply, num_points):
+    # Decodes an LCR reply (one or more points) into values - (num_points, 2) array of [Cp, Rp] - and status - (num_points,) int array
+    # REAL replies are raw bytes - '#0' indefinite length block of big-endian float64, ending with newline
+    if isinstance(reply, bytes):
+        num_digits = int(reply[1:2])
+        if num_digits == 0:
+            block = reply[2:]
+            block = block[:len(block) // 8 * 8]                             # Drop terminating newline
+        else:
+            block_length = int(reply[2:2 + num_digits])
+            block = reply[2 + num_digits:2 + num_digits + block_length]
+        data = np.frombuffer(block, dtype='>f8')
+    else:
+        data = np.array(reply.split(','), dtype=np.float64)
+
+    # Each point returns data A, data B, status (and a comparator result when enabled)
+    data = data.reshape(num_points, -1)
+    return data[:, :2], data[:, 2].astype(int)
+
+
+def readMeasurement(num_points):
+    # Triggers a measurement (single point or list sweep) and returns the decoded values and status
+    if data_format == "REAL":
+        lcr.write("*TRG")
+        return decodeMeasurement(lcr.read_raw(), num_points)
+    return decodeMeasurement(lcr.query("*TRG"), num_points)
+
+
+def readPoint(frequency):
+    # Single point measurement - returns [Cp, Rp] row
+    values, status = readMeasurement(1)
+    checkStatus([frequency], status)
+    return values[0]
+
+
+def checkStatus(frequencies, status):
+    for frequency, point_status in zip(frequencies, status):
+        if point_status != 0:
+            print("WARNING -", frequency, "Hz measurement status:", MEASUREMENT_STATUS.get(point_status, point_status))
+
+
+def tuneApertures():
+    # Measures each frequency 'tune_repeats' times at every setting in 'tune_settings', and picks the fastest setting
+    # with Cp and Rp relative standard deviation within 'tune_precision' (or the most repeatable, if none are) - returns the profile
+    profile = {"precision": tune_precision, "repeats": tune_repeats, "points": []}
+    for frequency in frequencies:
+        lcr.write(":FREQ:CW " + str(frequency))
+        results = []
+        for aperture, averaging in tune_settings:
+            lcr.write(":APER " + aperture + "," + str(averaging))
+            readings = np.empty((tune_repeats, 2))
+            start_time = time.perf_counter()
+            for repeat in range(tune_repeats):
+                lcr.write(":INIT")
+                readings[repeat] = readMeasurement(1)[0][0]
+            point_time = (time.perf_counter() - start_time) / tune_repeats
+            rel_std = readings.std(axis=0) / np.abs(readings.mean(axis=0))
+            results.append({"frequency": frequency, "aperture": aperture, "averaging": averaging, "point_time": point_time,
+                            "cp_rel_std": rel_std[0], "rp_rel_std": rel_std[1]})
+            print(frequency, "Hz", aperture, averaging, "-", round(point_time * 1e3, 1), "ms/point, Cp rel. std:", rel_std[0], "Rp rel. std:", rel_std[1])
+
+        passing = [result for result in results if max(result["cp_rel_std"], result["rp_rel_std"]) <= tune_precision]
+        if passing:
+            chosen = min(passing, key=lambda result: result["point_time"])
+        else:
+            chosen = min(results, key=lambda result: max(result["cp_rel_std"], result["rp_rel_std"]))
+            print("WARNING -", frequency, "Hz - no setting meets required precision, most repeatable setting used")
+        print("Chosen:", frequency, "Hz", chosen["aperture"], chosen["averaging"], "\n")
+        profile["points"].append(chosen)
+    return profile
+
+
+def loadApertureProfile():
+    # Loads the tuned profile (if one has been saved) into 'aperture_settings' - a list sweep can only use one setting for all points,
+    # so if the profile varies by frequency the sweep falls back to point-by-point
+    if not os.path.exists(profilePath):
+        return
+    with open(profilePath, "r") as file:
+        profile = json.load(file)
+    for point in profile["points"]:
+        if point["frequency"] in frequencies:
+            aperture_settings[point["frequency"]] = point["aperture"] + "," + str(point["averaging"])
+    print("Aperture profile loaded from", profilePath, "-", aperture_settings)
+
+    # Frequencies not in the profile (e.g. 'frequencies' edited since tuning) measured at the default setting, not the previous point's
+    missing = [frequency for frequency in frequencies if frequency not in aperture_settings]
+    if missing and aperture_settings:
+        print("WARNING - no tuned setting for", missing, "Hz -", default_aperture, "used (re-run tune mode to tune them)")
+        for frequency in missing:
+            aperture_settings[frequency] = default_aperture
+    applyApertureSettings()
+
+
+def applyApertureSettings():
+    # Applies 'aperture_settings' - one setting for every frequency is sent once, a per-frequency profile needs a point-by-point sweep
+    global list_sweep
+    settings = set(aperture_settings.values())
+    if len(settings) == 1 and len(aperture_settings) == len(frequencies):
+        lcr.write(":APER " + settings.pop())                               # Same setting for every frequency - applied once
+    elif aperture_settings and list_sweep:
+        list_sweep = False
+        print("Aperture profile varies by frequency - point-by-point sweep used")
+
+
+def setupListSweep():
+    if len(frequencies) > 201:
+        raise ValueError("List sweep table holds up to 201 frequencies - reduce 'frequencies' or set 'list_sweep' to False")
+    lcr.write(":DISP:PAGE LIST")                                            # List sweep only runs from the LIST SWEEP display page
+    lcr.write(":LIST:MODE SEQ")                                             # One trigger measures every point in the table
+    lcr.write(":LIST:FREQ " + ",".join(str(frequency) for frequency in frequencies))
 
 
 def tempReadingConvert(temperature):
@@ -319,57 +601,139 @@ def main():
     lcr.write(":TRIG:SOUR BUS")                                             # Set trigger function to WAIT FOR TRIGGER
     # Device waiting for trigger now
     lcr.write(":FUNC:IMP:TYPE CPRP")                                        # Setup LCR for Cp-Rp measurements
-    lcr.write(":FORMAT:DATA ASCII")                                         # Change output data type to ASCII
+    lcr.write(":FORMAT:DATA " + data_format)                               # Set output data type - binary REAL (64-bit) or ASCII
+
+    # Auto-tune mode - tune measurement time per frequency, save profile and finish
+    if tune_mode:
+        profile = tuneApertures()
+        with open(profilePath, "w") as file:
+            json.dump(profile, file, indent=4)
+        print("Aperture profile saved to", profilePath)
+        lcr.close()
+        rm.close()
+        missed_csv_file.close()
+        return
+
+    if checkpoint is None:
+        loadApertureProfile()                                               # Tuned measurement time per frequency (if saved)
+    else:
+        applyApertureSettings()                                             # Resumed run - apertures and sweep mode from the checkpoint
+        if aperture_settings:
+            print("Aperture settings restored from checkpoint -", aperture_settings)
+    if list_sweep:
+        setupListSweep()                                                    # Load sweep frequencies into list sweep table
     #----------------#
 
     #----DMM SETUP----#
     # Only reset required
     #-----------------#
 
-    # Set temperature counter variable (starting temperature)
-    tempCount = 30
-
-    # print flag - zero initially
-    alreadyWritten = 0
-
-    # Error flag - zero initially
-    errorFlag = 0
+    # Set temperature counter variable (starting temperature, or the degree after the last one checkpointed)
+    tempCount = start_temperature if checkpoint is None else checkpoint["last_bucket"] + 1
+
+    # Temperature sampled at a fixed rate, ramp rate fitted to predict each degree crossing
+    tracker = TempTracker(temp_sample_rate, ramp_fit_window)
+
+    # LCR armed (waiting for trigger) flag
+    armed = False
+
+    # Background temperature sampling during each sweep
+    sweep_sampler = SweepTempSampler(sweep_temp_sample_rate)
+
+    # Results database - every sweep is stored under this run's id
+    store = ResultsStore(dbPath, db_commit_sweeps, db_commit_interval)
+    if checkpoint is None:
+        run_id = store.startRun(A, d, frequencies)
+    else:
+        run_id = store.resumeRun(checkpoint["run_id"], checkpoint["sweeps"])
+    print("Results database:", dbPath, "- run", run_id)
+
+    # Last degree swept - checkpointed each time the results database is committed
+    last_bucket = tempCount - 1
+    writeCheckpoint(run_id, last_bucket, store.sweep)
+
+    # Sweep waiting for the next temperature sample (its end-of-sweep temperature) before it is stored
+    pending = None
+
+    try:
+        while tempCount <= end_temperature:
+            # Predict next degree crossing - if it falls before the next regular sample, arm the sweep and sample at the crossing
+            crossing = tracker.predictCrossing(tempCount)
+            if list_sweep and not armed and crossing is not None and crossing - time.monotonic() < tracker.period:
+                armSweep()
+                armed = True
+
+            sample_time, temperature = tracker.sample(crossing)
+            print("Temp:", temperature, "Degrees Centigrade    Ramp rate:", round(tracker.rampRate() * 60, 2), "Degrees Centigrade/min")
+
+            # Store the previous sweep - this sample covers its end
+            if pending is not None:
+                finishSweep(store, pending, sample_time, temperature)
+                last_bucket = pending["bucket"]
+                pending = None
+                if store.pending == 0:
+                    writeCheckpoint(run_id, last_bucket, store.sweep)
+
+            if temperature < tempCount:
+                continue
+
+            # Oven outran the sweep - record the degrees missed and catch up to the current degree
+            if temperature > (tempCount + 1):
+                timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+                for missed in range(tempCount, min(int(temperature), end_temperature + 1)):
+                    missed_csv_writer.writerow([timestamp, missed, temperature, tracker.rampRate() * 60])
+                missed_csv_file.flush()
+                print("WARNING - Temperature rising faster than sweep rate - missed", tempCount, "to", int(temperature) - 1, "Degrees Centigrade (logged to", missedPath + ")")
+                tempCount = int(temperature)
+                if tempCount > end_temperature:
+                    break
+
+            # Frequency sweep - once per Degrees C increment, temperature sampled in the background throughout
+            sweep_start = time.monotonic()
+            sweep_sampler.start()
+            try:
+                impValues, point_times = freqSweep(armed)
+            finally:
+                temp_times, temps = sweep_sampler.stop()
+            sweep_end = time.monotonic()
+            armed = False
+
+            # Temperature at each frequency point, and drift over the sweep - stored once the next temperature sample is taken
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+            pending = {"bucket": tempCount, "timestamp": timestamp, "temperature": temperature, "start": sweep_start, "end": sweep_end,
+                       "values": impValues, "point_times": point_times, "temp_times": temp_times, "temps": temps}
 
-    while True:
-        # Constantly monitor Temperature (specify Fs?)
-        temperature = dmm.query(":MEAS:TEMP?")
-        temperature = tempReadingConvert(temperature)
-        if errorFlag == 0:
             print("Temp:", temperature, "Degrees Centigrade")
+            tempCount = tempCount+1
+
+    finally:
+        # Last sweep - one more reading for its end temperature (readings taken during the sweep only, if the DMM is not responding)
+        # A failure here is reported rather than raised, so the commit, checkpoint and export below always run
+        if pending is not None:
+            try:
+                try:
+                    end_reading = tempReadingConvert(dmm.query(":MEAS:TEMP?"))
+                except Exception:
+                    finishSweep(store, pending)
+                else:
+                    finishSweep(store, pending, time.monotonic(), end_reading)
+                last_bucket = pending["bucket"]
+            except Exception as error:
+                print("WARNING - last sweep could not be stored:", error)
+
+        # Commit any remaining rows, checkpoint and export the run to the results .csv (also if the test is interrupted)
+        store.commit()
+        writeCheckpoint(run_id, last_bucket, store.sweep, complete=tempCount > end_temperature)
+        store.exportWideCsv(run_id, filePath)
+        store.close()
+        print("Results exported to", filePath)
+
+    print("Test complete - end temperature reached")
 
-        # Once temperature reaches 30 - take reading then continuously check for whole step changes
-        if tempCount <= temperature <= (tempCount+1):
-            errorFlag = 0
-            alreadyWritten = 0
-            if alreadyWritten == 0:                                         # Only perfrom frequency sweep once per Degrees C increment
-                impValues = freqSweep()
-                floatValues = splitString(impValues)
-                tan_deltas = calcLossTangent(floatValues)
-                permittivity = calcPermittivity(floatValues)
-                start_time = time.time()
-                timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))
-                csv_writer.writerow([timestamp,temperature,floatValues.float1_20Hz,floatValues.float2_20Hz,tan_deltas[1],permittivity[1],floatValues.float1_100Hz,floatValues.float2_100Hz,tan_deltas[2],permittivity[2],floatValues.float1_1kHz,floatValues.float2_1kHz,tan_deltas[3],permittivity[3],floatValues.float1_10kHz,floatValues.float2_10kHz,tan_deltas[4],permittivity[4],floatValues.float1_100kHz,floatValues.float2_100kHz,tan_deltas[5],permittivity[5],floatValues.float1_1MHz,floatValues.float2_1MHz,tan_deltas[6],permittivity[6],floatValues.float1_2MHz,floatValues.float2_2MHz,tan_deltas[7],permittivity[7]])
-                csv_file.flush()  # Flush buffer to ensure data is written immediately
-
-                print("Temp:", temperature, "Degrees Centigrade")
-                tempCount = tempCount+1
-                alreadyWritten = 1
-        
-        # If reading goes out of range (temperature goes high too quickly so as to not allow imp measurement) - throw error
-        if temperature > (tempCount + 1):
-            errorFlag = 1
-            if errorFlag == 1:
-                print("ERROR - Temperature out of range! Please reduce the temperature to between", tempCount, "and",(tempCount + 1))
-            
     # Close instrument connection
     lcr.close()
     rm.close()
-    csv_file.close()
+    missed_csv_file.close()
     input()
 
 
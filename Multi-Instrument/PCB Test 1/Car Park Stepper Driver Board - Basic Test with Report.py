@@ -5,7 +5,9 @@
 #
 #   - Author: Stuart Thomas
 #   - Date: 15/01/2025
-#   - Version: 1.0
+#   - Version: 1.1
+#    - Changelog: 1.0 -> 1.1
+#          - Test numbers allocated with allocate_test_number() - unique across concurrent processes/stations sharing the same directory
 #   - Description: - Program runs tests on the stepper motor driver PCB used in the Edinburgh Napier University Engineering Applications module.
 #                   Tests Performed:
 #                       - Short-circuit/resistance check
@@ -33,29 +35,52 @@ import pyvisa
 #file to store test number
 TEST_NUMBER_FILE = "test_number.txt"
 
-#function to init test number file if it doesn't exist
-def init_test_number():
-    if not os.path.exists(TEST_NUMBER_FILE):
-        with open(TEST_NUMBER_FILE, 'w') as file:
-            file.write('1')                                     #init test number to '1'
-            
-#function to read current test number
-def get_test_number():
-    with open(TEST_NUMBER_FILE, 'r') as file:
-        test_number = int(file.read())
+#function to allocate a unique test number
+def allocate_test_number(file_path='test_number.txt'):
+    """
+    Allocates the next unique test number - safe for several capture processes/stations sharing the same directory.
+    Each number is claimed by atomically creating a marker file in '<file_path>.claims' (exclusive create only
+    succeeds for one process), so no lock is taken and concurrent writers never wait on each other.
+    'file_path' only holds a hint of the next free number, so existing test number files carry on from their current value.
+    """
+    claims_dir = file_path + ".claims"
+    os.makedirs(claims_dir, exist_ok=True)
+
+    # Start from hint of next free number (fall back to highest claimed number if hint is missing)
+    try:
+        with open(file_path, 'r') as file:
+            test_number = int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        claimed = [int(name) for name in os.listdir(claims_dir) if name.isdigit()]
+        test_number = max(claimed, default=0) + 1
+
+    # Claim first free number at or above the hint
+    while True:
+        try:
+            os.close(os.open(os.path.join(claims_dir, str(test_number)), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            test_number += 1
+
+    # Advance hint - never moved back by a slower process, and written to a temporary file then renamed so it is never read half written.
+    # (Two processes can still race between the check and the rename - a stale hint only costs extra claim attempts, as numbers are
+    # always claimed in order from the hint, so they stay unique and increasing)
+    try:
+        with open(file_path, 'r') as file:
+            current_hint = int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        current_hint = 0
+    if test_number + 1 > current_hint:
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            file.write(str(test_number + 1))
+        os.replace(temp_path, file_path)
+
     return test_number
     
-#function to update the test number
-def increment_test_number():
-    test_number = get_test_number() +1
-    with open(TEST_NUMBER_FILE, 'w') as file:
-        file.write(str(test_number))
-    
 #function to create test report
 def create_test_report():
-    init_test_number()
-    
-    test_number = get_test_number()
+    test_number = allocate_test_number(TEST_NUMBER_FILE)
     current_date = datetime.now().strftime("%d-%m-%Y")
     
     filename = f"STEPPER-PCB-TEST_{test_number:04d}_{current_date}.csv"
@@ -96,8 +121,6 @@ def create_test_report():
         #add user notes
         writer.writerow([])
         writer.writerow(["User Notes", user_notes or "No notes provided"])
-        
-    increment_test_number()
     
     print(f"\nTest report saved as {filename}")
 